@@ -0,0 +1,238 @@
+import os
+
+import numpy as np
+
+# Interpolation flags, same values as cv2.INTER_
+INTER_NEAREST, INTER_LINEAR, INTER_CUBIC, INTER_AREA, INTER_LANCZOS4 = 0, 1, 2, 3, 4
+INTER_LINEAR_EXACT, INTER_NEAREST_EXACT, INTER_MAX = 5, 6, 7
+
+# Interpolations of the NumPy resize (also used for region resize by every backend)
+NUMPY_INTERPOLATIONS = (INTER_NEAREST, INTER_LINEAR, INTER_AREA)
+
+def dct_matrix(size: int = 8) -> np.ndarray:
+    '''
+    Orthonormal DCT-II matrix: dct(X) = C @ X @ C.T, idct(X) = C.T @ X @ C
+    '''
+    n = np.arange(size)
+    c = np.sqrt(2 / size) * np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    c[0] /= np.sqrt(2)
+    return c
+
+def _resize_axis(data: np.ndarray, axis: int, src_len: int, dst_len: int, dst_start: int, dst_stop: int,
+                 offset: int, interpolation: int, box: bool) -> np.ndarray:
+    '''
+    Samples [dst_start, dst_stop) along [axis] of the resize of an axis from [src_len] to [dst_len] samples.
+    [data] holds the source samples from index [offset].
+    '''
+    dst     = np.arange(dst_start, dst_stop)
+    if src_len == dst_len:
+        return data.take(dst - offset, axis)
+    scale   = src_len / dst_len
+    shape   = [-1 if i == axis else 1 for i in range(data.ndim)]
+    if box: # box filter: average of the covered source interval
+        csum    = np.concatenate([np.zeros_like(data.take([0], axis)), np.cumsum(data, axis, dtype=np.float64)], axis)
+        edges   = np.arange(dst_start, dst_stop + 1) * scale
+        floor   = np.minimum(np.floor(edges).astype(np.intp), src_len - 1)
+        frac    = (edges - floor).reshape(shape)
+        integral = csum.take(floor - offset, axis) + frac * data.take(floor - offset, axis)
+        return np.float32(np.diff(integral, axis=axis) / scale)
+    if interpolation == INTER_NEAREST:
+        first   = np.minimum(np.floor(dst * scale).astype(np.intp), src_len - 1)
+        return data.take(first - offset, axis)
+    if interpolation == INTER_AREA:
+        first   = np.floor(dst * scale).astype(np.intp)
+        weight  = (dst + 1) - (first + 1) / scale
+        weight  = np.where(weight <= 0, 0, weight - np.floor(weight))
+    else: # linear
+        pos     = (dst + 0.5) * scale - 0.5
+        first   = np.floor(pos).astype(np.intp)
+        weight  = pos - first
+        weight[first < 0] = 0
+        first[first < 0] = 0
+    weight[first >= src_len - 1] = 0
+    first   = np.minimum(first, src_len - 1)
+    second  = np.minimum(first + 1, src_len - 1)
+    weight  = np.float32(weight).reshape(shape)
+    return data.take(first - offset, axis) * (1 - weight) + data.take(second - offset, axis) * weight
+
+def _resize_region(data: np.ndarray, origin: tuple, source_shape: tuple, size: tuple, region: tuple,
+                   interpolation: int) -> np.ndarray:
+    '''
+    Resize a 2D plane of [source_shape] to [size] (width, height) and return [region] (y, x, h, w) of the result.
+    [data] is the part of the plane at [origin] (y, x) that covers the region (with interpolation margin).
+    '''
+    if interpolation not in NUMPY_INTERPOLATIONS:
+        raise ValueError(f'Interpolation {interpolation} is not supported by the NumPy resize '
+                         f'(support: nearest, linear, area). Use the OpenCV backend for full-image resize.')
+    width, height   = size
+    y, x, h, w      = region
+    # as cv2, the box filter is used only if no axis is upscaled
+    box     = interpolation == INTER_AREA and height <= source_shape[0] and width <= source_shape[1]
+    result  = _resize_axis(np.float32(data), 0, source_shape[0], height, y, y + h, origin[0], interpolation, box)
+    result  = _resize_axis(result, 1, source_shape[1], width, x, x + w, origin[1], interpolation, box)
+    if np.issubdtype(data.dtype, np.integer):
+        info = np.iinfo(data.dtype)
+        return np.clip(np.rint(result), info.min, info.max).astype(data.dtype)
+    return result.astype(data.dtype)
+
+class NumpyBackend(object):
+    '''
+    Pure NumPy implementation of the image primitives (no OpenCV needed).
+    Interpolation: nearest, linear and area. Others raise ValueError.
+    '''
+    name            = 'numpy'
+    interpolations  = NUMPY_INTERPOLATIONS
+
+    def __init__(self) -> None:
+        self.dct_matrix = dct_matrix()
+
+    def dct(self, data: np.ndarray) -> np.ndarray:
+        '''
+        2D DCT of one block (8 x 8) or a batch of blocks (... x 8 x 8)
+        '''
+        # computed in double precision: results close to integers must not fall below them (truncated later)
+        return np.float32(self.dct_matrix @ np.float64(data) @ self.dct_matrix.T)
+
+    def idct(self, data: np.ndarray, support: int = 8) -> np.ndarray:
+        '''
+        2D IDCT of one block or a batch of blocks. Only the [support] x [support] low frequency coefs
+        of [data] are used (data may be ... x support x support), the result is always ... x 8 x 8.
+        '''
+        basis = self.dct_matrix[:support]
+        return np.float32(basis.T @ np.float64(data[..., :support, :support]) @ basis)
+
+    def bgr2ycrcb(self, data: np.ndarray) -> np.ndarray:
+        # fixed-point coefficients (14 bits) as 8-bit cv2.cvtColor
+        b, g, r = [np.int32(c) for c in self.split(data)]
+        y   = (r * 4899 + g * 9617 + b * 1868 + (1 << 13)) >> 14
+        cr  = ((r - y) * 11682 + (128 << 14) + (1 << 13)) >> 14
+        cb  = ((b - y) * 9241 + (128 << 14) + (1 << 13)) >> 14
+        return np.uint8(np.clip(self.merge([y, cr, cb]), 0, 255))
+
+    def ycrcb2bgr(self, data: np.ndarray) -> np.ndarray:
+        y, cr, cb = [np.int32(c) for c in self.split(data)]
+        cr, cb = cr - 128, cb - 128
+        b   = y + ((cb * 29049 + (1 << 13)) >> 14)
+        g   = y + ((cb * -5636 + cr * -11698 + (1 << 13)) >> 14)
+        r   = y + ((cr * 22987 + (1 << 13)) >> 14)
+        return np.uint8(np.clip(self.merge([b, g, r]), 0, 255))
+
+    def resize(self, data: np.ndarray, size: tuple, interpolation: int = INTER_LINEAR) -> np.ndarray:
+        '''
+        Resize 2D [data] to [size] (width, height). Separable: rows then columns.
+        '''
+        width, height = size
+        return _resize_region(data, (0, 0), data.shape[:2], size, (0, 0, height, width), interpolation)
+
+    def resize_region(self, data: np.ndarray, origin: tuple, source_shape: tuple, size: tuple, region: tuple,
+                      interpolation: int = INTER_LINEAR) -> np.ndarray:
+        '''
+        Resize only [region] of a plane. See _resize_region().
+        '''
+        return _resize_region(data, origin, source_shape, size, region, interpolation)
+
+    def pad_replicate(self, data: np.ndarray, bottom: int, right: int) -> np.ndarray:
+        return np.pad(data, ((0, bottom), (0, right)), mode='edge')
+
+    def split(self, data: np.ndarray) -> list[np.ndarray]:
+        return [data[:, :, i] for i in range(data.shape[2])]
+
+    def merge(self, planes: list[np.ndarray]) -> np.ndarray:
+        return np.stack(planes, axis=-1)
+
+class OpenCVBackend(object):
+    '''
+    OpenCV implementation of the image primitives. Import cv2 on creation.
+    '''
+    name            = 'opencv'
+    interpolations  = (INTER_NEAREST, INTER_LINEAR, INTER_CUBIC, INTER_AREA, INTER_LANCZOS4,
+                       INTER_LINEAR_EXACT, INTER_NEAREST_EXACT, INTER_MAX)
+
+    def __init__(self) -> None:
+        import cv2
+        self.cv2 = cv2
+
+    def dct(self, data: np.ndarray) -> np.ndarray:
+        data = np.float32(data)
+        if data.ndim == 2:
+            return self.cv2.dct(data)
+        return np.array([self.cv2.dct(b) for b in data.reshape(-1, 8, 8)]).reshape(data.shape)
+
+    def idct(self, data: np.ndarray, support: int = 8) -> np.ndarray:
+        if support < 8: # zero extend: cv2.idct of the full block is as cheap as any partial transform here
+            full = np.zeros(data.shape[:-2] + (8, 8), dtype=np.float32)
+            full[..., :support, :support] = data[..., :support, :support]
+            data = full
+        data = np.float32(data)
+        if data.ndim == 2:
+            return self.cv2.idct(data)
+        return np.array([self.cv2.idct(b) for b in data.reshape(-1, 8, 8)]).reshape(data.shape)
+
+    def bgr2ycrcb(self, data: np.ndarray) -> np.ndarray:
+        return self.cv2.cvtColor(data, self.cv2.COLOR_BGR2YCrCb)
+
+    def ycrcb2bgr(self, data: np.ndarray) -> np.ndarray:
+        return self.cv2.cvtColor(data, self.cv2.COLOR_YCrCb2BGR)
+
+    def resize(self, data: np.ndarray, size: tuple, interpolation: int = INTER_LINEAR) -> np.ndarray:
+        return self.cv2.resize(data, size, interpolation=interpolation)
+
+    def resize_region(self, data: np.ndarray, origin: tuple, source_shape: tuple, size: tuple, region: tuple,
+                      interpolation: int = INTER_LINEAR) -> np.ndarray:
+        # no cv2 equivalent: NumPy implementation (nearest, linear, area only; may differ by 1 level from cv2.resize)
+        return _resize_region(data, origin, source_shape, size, region, interpolation)
+
+    def pad_replicate(self, data: np.ndarray, bottom: int, right: int) -> np.ndarray:
+        return self.cv2.copyMakeBorder(data, 0, bottom, 0, right, self.cv2.BORDER_REPLICATE)
+
+    def split(self, data: np.ndarray) -> list[np.ndarray]:
+        return list(self.cv2.split(data))
+
+    def merge(self, planes: list[np.ndarray]) -> np.ndarray:
+        return self.cv2.merge(planes)
+
+_backends   = {'numpy': NumpyBackend, 'opencv': OpenCVBackend}
+_current    = None
+
+def set_backend(name: str):
+    '''
+    Select the backend for all codecs: 'numpy' (default) or 'opencv'.
+    Default can also be set by environment variable JPEG_BACKEND.
+    '''
+    global _current
+    if name not in _backends:
+        raise ValueError(f'Unknown backend {name}. Support: {list(_backends)}')
+    _current = _backends[name]()
+
+def get_backend():
+    if _current is None:
+        set_backend(os.environ.get('JPEG_BACKEND', 'numpy'))
+    return _current
+
+def dct(data: np.ndarray) -> np.ndarray:
+    return get_backend().dct(data)
+
+def idct(data: np.ndarray, support: int = 8) -> np.ndarray:
+    return get_backend().idct(data, support)
+
+def bgr2ycrcb(data: np.ndarray) -> np.ndarray:
+    return get_backend().bgr2ycrcb(data)
+
+def ycrcb2bgr(data: np.ndarray) -> np.ndarray:
+    return get_backend().ycrcb2bgr(data)
+
+def resize(data: np.ndarray, size: tuple, interpolation: int = INTER_LINEAR) -> np.ndarray:
+    return get_backend().resize(data, size, interpolation)
+
+def resize_region(data: np.ndarray, origin: tuple, source_shape: tuple, size: tuple, region: tuple,
+                  interpolation: int = INTER_LINEAR) -> np.ndarray:
+    return get_backend().resize_region(data, origin, source_shape, size, region, interpolation)
+
+def pad_replicate(data: np.ndarray, bottom: int, right: int) -> np.ndarray:
+    return get_backend().pad_replicate(data, bottom, right)
+
+def split(data: np.ndarray) -> list[np.ndarray]:
+    return get_backend().split(data)
+
+def merge(planes: list[np.ndarray]) -> np.ndarray:
+    return get_backend().merge(planes)
@@ -0,0 +1,427 @@
+import json
+import mmap
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from frame import Frame, create_frame
+import utils
+
+IMAGE_EXTENSIONS    = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.npy')
+MANIFEST            = 'manifest.jsonl'
+PACK                = 'pack.bin'
+
+########## Inputs and outputs ###########
+# Output folder: one pack file (results appended back to back) and one manifest (JSON lines).
+# First manifest line is the header {"operation", "config"}, then one line per item:
+# {"name", "offset", "length", "shape"[, "mode"]}. Encoded packs are decoded with the config of their header.
+
+def scan_directory(root: str) -> list[dict]:
+    '''
+    Items for all images under [root] (sorted). Names are relative paths.
+    '''
+    items = []
+    for folder, _, files in os.walk(root):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(folder, file)
+                items.append({'name': os.path.relpath(path, root), 'path': path})
+    return sorted(items, key=lambda item: item['name'])
+
+def read_list(path: str) -> list[dict]:
+    '''
+    Items for the image paths listed in text file [path] (one per line, relative to the file).
+    '''
+    folder = os.path.dirname(os.path.abspath(path))
+    with open(path) as file:
+        names = [line.strip() for line in file if line.strip()]
+    return [{'name': name, 'path': os.path.join(folder, name)} for name in names]
+
+def read_manifest(folder: str) -> tuple[dict | None, list[dict]]:
+    '''
+    Header and entries of the pack in [folder]. An incomplete last line (interrupted write) is ignored.
+    '''
+    path = os.path.join(folder, MANIFEST)
+    if not os.path.exists(path):
+        return None, []
+    with open(path, 'rb') as file:
+        lines = file.read().split(b'\n')[:-1] # the part after the last newline is incomplete
+    records = [json.loads(line) for line in lines if line]
+    if not records:
+        return None, []
+    return records[0], records[1:]
+
+def read_pack(folder: str, buffer_size: int = 16 << 20):
+    '''
+    Yield (entry, data) of every item of the pack in [folder].
+    Decoded images: np.frombuffer(data, dtype=np.uint8).reshape(entry['shape'])
+    '''
+    _, entries = read_manifest(folder)
+    if not entries:
+        return
+    with open(os.path.join(folder, PACK), 'rb', buffering=buffer_size) as file:
+        for entry in entries:
+            if file.tell() != entry['offset']:
+                file.seek(entry['offset'])
+            yield entry, file.read(entry['length'])
+
+def _load_image(path: str) -> np.ndarray:
+    '''
+    Image file or .npy array (not converted: uint8, H x W or H x W x 3).
+    '''
+    if path.lower().endswith('.npy'):
+        image = np.load(path, mmap_mode='r')
+        if image.dtype != np.uint8 or not (image.ndim == 2 or (image.ndim == 3 and image.shape[2] == 3)):
+            raise ValueError(f'{path}: expected a uint8 H x W or H x W x 3 array, got {image.dtype} {image.shape}')
+        return image
+    image = utils.load_image(path)
+    if image is None:
+        raise ValueError(f'Cannot read image {path}')
+    return image
+
+class _PackWriter(object):
+    '''
+    Append results to the pack with a large write buffer. Manifest lines are written at checkpoints only,
+    after the pack is flushed, so the manifest never refers to data that is not on disk.
+    Reopening a folder resumes it: data after the last checkpoint is dropped.
+    '''
+    def __init__(self, folder: str, header: dict, buffer_size: int) -> None:
+        os.makedirs(folder, exist_ok=True)
+        pack_path       = os.path.join(folder, PACK)
+        manifest_path   = os.path.join(folder, MANIFEST)
+        current, entries = read_manifest(folder)
+        header          = json.loads(json.dumps(header)) # as stored
+        if current is not None and current != header:
+            raise ValueError(f'{folder} holds a pack with another configuration: {current}')
+        self.names      = {entry['name'] for entry in entries}
+        self.size       = max([entry['offset'] + entry['length'] for entry in entries], default=0)
+        # drop what follows the last checkpoint
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'rb+') as file:
+                content = file.read()
+                file.truncate(content.rfind(b'\n') + 1)
+        if os.path.exists(pack_path):
+            os.truncate(pack_path, self.size)
+        self.pack       = open(pack_path, 'ab', buffering=buffer_size)
+        self.manifest   = open(manifest_path, 'a')
+        if current is None:
+            self.manifest.write(json.dumps(header) + '\n')
+        self.pending    = []
+
+    def write(self, entry: dict, data) -> None:
+        entry = dict(entry, offset=self.size, length=len(data))
+        self.pack.write(data)
+        self.size += entry['length']
+        self.pending.append(entry)
+
+    def checkpoint(self):
+        self.pack.flush()
+        for entry in self.pending:
+            self.manifest.write(json.dumps(entry) + '\n')
+        self.manifest.flush()
+        self.pending = []
+
+    def close(self):
+        self.checkpoint()
+        self.pack.close()
+        self.manifest.close()
+
+########## Worker side ###########
+# Each worker process owns one Frame, configured (and warmed) once on start.
+# Tasks only carry a slot number and a shape: pixels and encoded data stay in shared memory.
+
+def _convert(frame: Frame, operation: str, inputs, outputs, offset: int, slot_size: int,
+             length: int, shape: tuple, mode: str) -> tuple[int, bytes | None]:
+    '''
+    Convert the data of one slot. :return: Size of the result in the output slot, or the result itself if too large.
+    '''
+    if operation == 'encode':
+        data    = np.ndarray(shape, dtype=np.uint8, buffer=inputs.buf, offset=offset)
+        result  = frame.encode(data, mode=mode)
+        del data
+    else:
+        result  = frame.decode(bytes(inputs.buf[offset:offset + length]), shape, mode=mode).tobytes()
+    if len(result) > slot_size:
+        return len(result), result
+    outputs.buf[offset:offset + len(result)] = result
+    return len(result), None
+
+def _worker(config: dict, operation: str, names: tuple, slot_size: int, tasks: mp.Queue, results: mp.Queue):
+    frame   = create_frame(config)
+    inputs  = SharedMemory(name=names[0])
+    outputs = SharedMemory(name=names[1])
+    try:
+        while (task := tasks.get()) is not None:
+            index, slot, length, shape, mode = task
+            start = time.perf_counter()
+            try:
+                size, overflow = _convert(frame, operation, inputs, outputs, slot * slot_size, slot_size, length, shape, mode)
+                results.put((index, slot, size, overflow, time.perf_counter() - start, None))
+            except Exception as e:
+                results.put((index, slot, 0, None, time.perf_counter() - start, repr(e)))
+    finally:
+        inputs.close()
+        outputs.close()
+
+########## Converter ###########
+
+class BatchConverter(object):
+    '''
+    Encode (or decode) many images with a pool of pre-spawned worker processes, each holding a warmed Frame.
+    Data moves through two shared memory ring buffers of [slots] slots ([slot_size] bytes each, input and output):
+    only slot numbers and shapes cross process boundaries. Items larger than a slot are converted in this process.
+    Results go to one pack file with large buffered writes ([buffer_size] bytes), indexed by a manifest which is
+    also the checkpoint (every [checkpoint_every] items): run() skips the items already in the output.
+    '''
+    def __init__(self, workers: int | None = None, slots: int | None = None, slot_size: int = 32 << 20, *,
+                 operation: str = 'encode', quality: int | list = 50, sampling_factor: int | str | list = 420,
+                 interpolation: str | list = 'linear', progressive: bool | list = False, restart_interval: int = 0,
+                 mode: str = 'non-interleave', buffer_size: int = 16 << 20, checkpoint_every: int = 64) -> None:
+        if operation not in ('encode', 'decode'):
+            raise ValueError(f'Unknown operation {operation}. Support: encode, decode')
+        self.workers            = workers or os.cpu_count() or 1
+        self.slots              = slots or 2 * self.workers
+        self.slot_size          = slot_size
+        self.operation          = operation
+        self.mode               = mode
+        self.buffer_size        = buffer_size
+        self.checkpoint_every   = checkpoint_every
+        self.config             = {'quality': quality, 'sampling_factor': sampling_factor, 'interpolation': interpolation,
+                                   'progressive': progressive, 'restart_interval': restart_interval}
+        self.processes          = []
+        self.inputs             = None
+        self.outputs            = None
+        self.frame              = None # for items larger than a slot
+
+    def header(self) -> dict:
+        '''
+        Header of the output manifest. The config is the one needed to decode an encoded pack.
+        '''
+        return {'operation': self.operation, 'config': self.config}
+
+    def start(self) -> 'BatchConverter':
+        '''
+        Create the ring buffers, spawn and warm up the worker processes.
+        '''
+        self.inputs     = SharedMemory(create=True, size=self.slots * self.slot_size)
+        self.outputs    = SharedMemory(create=True, size=self.slots * self.slot_size)
+        self.tasks      = mp.Queue()
+        self.results    = mp.Queue()
+        names           = (self.inputs.name, self.outputs.name)
+        self.processes  = [mp.Process(target=_worker, daemon=True,
+                                      args=(self.config, self.operation, names, self.slot_size, self.tasks, self.results))
+                           for _ in range(self.workers)]
+        for process in self.processes:
+            process.start()
+        return self
+
+    def stop(self):
+        '''
+        Stop the worker processes and release the ring buffers.
+        '''
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        for memory in (self.inputs, self.outputs):
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+        self.inputs = self.outputs = None
+
+    def __enter__(self) -> 'BatchConverter':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def run(self, items: list[dict], output: str, source: str | None = None, report_every: float = 0) -> dict:
+        '''
+        Convert [items] into the pack in folder [output], resuming it if it exists.
+        Encode: items have "name" and "path" (see scan_directory(), read_list()).
+        Decode: items are the entries of the encoded pack in folder [source] (see read_manifest()).
+        [report_every]: Print progress to stderr every [report_every] seconds (0 to disable).
+        :return: Throughput report.
+        '''
+        if not self.processes:
+            raise RuntimeError('Converter is not started')
+        writer  = _PackWriter(output, self.header(), self.buffer_size)
+        source_file = source_pack = None
+        if self.operation == 'decode':
+            source_file = open(os.path.join(source, PACK), 'rb')
+            source_pack = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.stats      = dict.fromkeys(['items', 'skipped', 'inline', 'input_bytes', 'output_bytes', 'busy'], 0)
+        self.errors     = []
+        self.busy_slots = {} # slot -> item
+        self.free_slots = deque(range(self.slots))
+        self.written    = 0
+        start = last_report = time.perf_counter()
+        try:
+            for index, item in enumerate(items):
+                if item['name'] in writer.names:
+                    self.stats['skipped'] += 1
+                    continue
+                while not self.free_slots:
+                    self._collect(writer, block=True)
+                while self._collect(writer, block=False):
+                    pass
+                self._submit(index, item, writer, source_pack)
+                if report_every and time.perf_counter() - last_report >= report_every:
+                    last_report = time.perf_counter()
+                    print(self._progress(last_report - start), file=sys.stderr)
+            while self.busy_slots:
+                self._collect(writer, block=True)
+        finally:
+            writer.close()
+            if source_pack is not None:
+                source_pack.close()
+                source_file.close()
+        return self._report(time.perf_counter() - start)
+
+    def _submit(self, index: int, item: dict, writer: _PackWriter, source_pack: mmap.mmap | None):
+        '''
+        Load [item] into a free input slot and send it to the workers (or convert it here if it is too large).
+        '''
+        mode = item.get('mode', self.mode)
+        try:
+            if self.operation == 'encode':
+                data    = _load_image(item['path'])
+                shape   = data.shape
+                length  = int(np.prod(shape))
+            else:
+                shape   = tuple(item['shape'])
+                length  = item['length']
+                data    = source_pack[item['offset']:item['offset'] + length]
+        except Exception as e:
+            self.errors.append((item['name'], repr(e)))
+            return
+        self.stats['input_bytes'] += length
+
+        if length > self.slot_size or (self.operation == 'decode' and int(np.prod(shape)) > self.slot_size):
+            self._convert_inline(item, data, shape, mode, writer)
+            return
+        slot    = self.free_slots.popleft()
+        offset  = slot * self.slot_size
+        if self.operation == 'encode':
+            view    = np.ndarray(shape, dtype=np.uint8, buffer=self.inputs.buf, offset=offset)
+            view[...] = data
+            del view
+        else:
+            self.inputs.buf[offset:offset + length] = data
+        self.busy_slots[slot] = dict(item, shape=list(shape), mode=mode)
+        self.tasks.put((index, slot, length, shape, mode))
+
+    def _convert_inline(self, item: dict, data, shape: tuple, mode: str, writer: _PackWriter):
+        if self.frame is None:
+            self.frame = create_frame(self.config)
+        start = time.perf_counter()
+        try:
+            if self.operation == 'encode':
+                result = self.frame.encode(np.asarray(data), mode=mode)
+            else:
+                result = self.frame.decode(bytes(data), shape, mode=mode).tobytes()
+        except Exception as e:
+            self.errors.append((item['name'], repr(e)))
+            return
+        self.stats['busy']      += time.perf_counter() - start
+        self.stats['inline']    += 1
+        self._write(dict(item, shape=list(shape), mode=mode), result, writer)
+
+    def _collect(self, writer: _PackWriter, block: bool) -> bool:
+        '''
+        Write the result of one finished item and free its slot. :return: False if no result is ready.
+        '''
+        while True:
+            try:
+                index, slot, size, overflow, busy, error = self.results.get(timeout=1 if block else 0.001)
+                break
+            except queue.Empty:
+                if not block:
+                    return False
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError('A worker process died')
+        item = self.busy_slots.pop(slot)
+        self.stats['busy'] += busy
+        if error is not None:
+            self.errors.append((item['name'], error))
+        elif overflow is not None:
+            self._write(item, overflow, writer)
+        else:
+            offset = slot * self.slot_size
+            self._write(item, self.outputs.buf[offset:offset + size], writer)
+        self.free_slots.append(slot)
+        return True
+
+    def _write(self, item: dict, data, writer: _PackWriter):
+        entry = {'name': item['name'], 'shape': item['shape']}
+        if self.operation == 'encode':
+            entry['mode'] = item['mode']
+        writer.write(entry, data)
+        self.stats['items']         += 1
+        self.stats['output_bytes']  += len(data)
+        self.written += 1
+        if self.written % self.checkpoint_every == 0:
+            writer.checkpoint()
+
+    def _progress(self, elapsed: float) -> str:
+        return f'{self.stats["items"]} items, {self.stats["skipped"]} skipped, {len(self.errors)} errors, ' \
+               f'{self.stats["items"] / elapsed:.1f} items/s, {self.stats["input_bytes"] / elapsed / 1e6:.1f} MB/s in'
+
+    def _report(self, elapsed: float) -> dict:
+        elapsed = max(elapsed, 1e-9)
+        return {
+            **{k: v for k, v in self.stats.items() if k != 'busy'},
+            'errors'            : self.errors,
+            'seconds'           : elapsed,
+            'items_per_second'  : self.stats['items'] / elapsed,
+            'input_mb_per_second'   : self.stats['input_bytes'] / elapsed / 1e6,
+            'output_mb_per_second'  : self.stats['output_bytes'] / elapsed / 1e6,
+            # fraction of the time the workers spent converting (the rest is waiting for I/O)
+            'worker_utilization': self.stats['busy'] / (elapsed * self.workers),
+        }
+
+def main(args):
+    if args.operation == 'encode':
+        items   = scan_directory(args.source) if os.path.isdir(args.source) else read_list(args.source)
+        config  = {'quality': args.quality, 'sampling_factor': args.sampling, 'interpolation': args.interpolation,
+                   'progressive': args.progressive, 'restart_interval': args.restart_interval}
+    else:
+        header, items = read_manifest(args.source)
+        if header is None or header['operation'] != 'encode':
+            raise SystemExit(f'{args.source} is not an encoded pack')
+        config  = header['config']
+    with BatchConverter(args.workers, args.slots, args.slot_mb << 20, operation=args.operation, mode=args.mode,
+                        checkpoint_every=args.checkpoint_every, **config) as converter:
+        report = converter.run(items, args.output, args.source, args.report_every)
+    for name, error in report.pop('errors'):
+        print(f'error: {name}: {error}', file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Batch Encode/Decode images (shared memory workers, resumable)')
+    parser.add_argument('operation', choices=['encode', 'decode'])
+    parser.add_argument('source', help='encode: image folder or list file. decode: folder of an encoded pack')
+    parser.add_argument('output', help='output folder (pack and manifest), resumed if it exists')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--slots', type=int, default=None, help='ring buffer slots (default: 2 per worker)')
+    parser.add_argument('--slot-mb', type=int, default=32, help='size of a slot (MB)')
+    parser.add_argument('--mode', default='non-interleave')
+    parser.add_argument('--quality', type=int, default=50)
+    parser.add_argument('--sampling', default=420, type=utils.parse_sampling_format, help='420 or 4:2:0')
+    parser.add_argument('--interpolation', default='linear')
+    parser.add_argument('--progressive', action='store_true')
+    parser.add_argument('--restart-interval', type=int, default=0)
+    parser.add_argument('--checkpoint-every', type=int, default=64, help='items between checkpoints')
+    parser.add_argument('--report-every', type=float, default=5, help='progress report period (seconds, 0 to disable)')
+    main(parser.parse_args())
@@ -1,10 +1,12 @@
 import numpy as np
-import cv2
-from bitarray import bitarray
 
 from table import QuantizationTable, HuffmanTable
+from utils import ZigZagIndex, last_nonzero_index
 from huffman import HuffmanEncoder, HuffmanDecoder
-from bitutils import StateStream
+import backend
+
+# Zigzag indices 0..9 are exactly the coefs in the 4 x 4 low frequency corner
+LOW_FREQUENCY_COEFS = 10
 
 class Block(object):
     '''
@@ -14,16 +16,26 @@ class Block(object):
         self.quant = quant
         self.huffman = HuffmanEncoder(dc_huff, ac_huff) if mode == 'encode' else HuffmanDecoder(dc_huff, ac_huff)
     
-    def encode(self, data: np.ndarray, pred_dc: int) -> tuple[bitarray, int]:
-        fdct = cv2.dct(np.float32(data))
-        quant = np.int32(fdct / self.quant.table)
-        return self.huffman.encode(quant, pred = pred_dc), int(quant[0][0])
-    
-    def decode(self, stream: StateStream, pred_dc: int) -> tuple[np.ndarray, int]:
-        dec     = self.huffman.decode(stream, pred = pred_dc)
-        dequant = np.float32(dec * self.quant.table)
-        idct    = cv2.idct(dequant)
-        return idct, int(dec[0][0])
+    def itransform_all(self, coefs: np.ndarray, last: np.ndarray | None = None) -> np.ndarray:
+        '''
+        Dequantization and IDCT of all blocks at once. [coefs]: N x 64 (zigzag order). :return: N x 8 x 8
+        Blocks are grouped by their last nonzero coef ([last], recorded by the entropy decoder or found here if None):
+        DC only, 4 x 4 low frequency (zigzag index < LOW_FREQUENCY_COEFS), full.
+        '''
+        dequant = np.float32(coefs[:, ZigZagIndex] * self.quant.table.reshape(-1)).reshape(-1, 8, 8)
+        if last is None:
+            last = last_nonzero_index(coefs)
+        result  = np.empty_like(dequant)
+
+        dc_only = last == 0
+        result[dc_only] = dequant[dc_only, :1, :1] / 8
+        low     = (last > 0) & (last < LOW_FREQUENCY_COEFS)
+        if low.any():
+            result[low] = backend.idct(dequant[low, :4, :4], support=4)
+        full    = last >= LOW_FREQUENCY_COEFS
+        if full.any():
+            result[full] = backend.idct(dequant[full])
+        return result
 
 class BlockExtend(object):
     '''
@@ -69,6 +81,34 @@ class BlockExtend(object):
         self.group_count = (size[0] * size[1] // self.group_size) >> 6
         return self
 
+    def positions(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        (row, column) of all blocks (in block unit), in the order of get_next()/put_next()
+        '''
+        index = np.arange(self.group_count * self.group_size)
+        group_pos = np.divmod(index // self.group_size, self.group_step)
+        block_pos = np.divmod(index % self.group_size, self.step[0])
+        return group_pos[1] * self.step[1] + block_pos[1], group_pos[0] * self.step[0] + block_pos[0]
+
+    def put_all(self, blocks: np.ndarray) -> 'BlockExtend':
+        '''
+        Put all blocks (N x 8 x 8, in the order of put_next()) at once.
+        '''
+        rows, cols = self.positions()
+        grid = np.zeros((self.raw.shape[0] >> 3, self.raw.shape[1] >> 3, 8, 8), dtype=self.raw.dtype)
+        grid[rows, cols] = blocks
+        self.raw = grid.transpose(0, 2, 1, 3).reshape(self.raw.shape)
+        self.group_index = self.group_count
+        return self
+
+    def seek(self, group_index: int) -> 'BlockExtend':
+        '''
+        Move to the first block of group [group_index]
+        '''
+        self.group_index = group_index
+        self.block_index = 0
+        return self
+
     def put_next(self, data: np.ndarray) -> 'BlockExtend':
         indices = self.move_next()
         self.raw[indices] = data
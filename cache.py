@@ -0,0 +1,139 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+
+class EncodeCache(object):
+    '''
+    Content-addressed on-disk store for encoded/decoded results.
+    Entries are files named by their key. Writes are atomic (write to temporary file then rename),
+    so several processes can share one directory. The total size is bounded by [max_size] bytes,
+    least recently used entries (by modification time, refreshed on every hit) are evicted first.
+    '''
+    _tmp_prefix = '.tmp-'
+
+    def __init__(self, root: str, max_size: int = 256 << 20) -> None:
+        self.root       = root
+        self.max_size   = max_size
+        self.hits       = 0
+        self.misses     = 0
+        self.writes     = 0
+        self.evictions  = 0
+        os.makedirs(root, exist_ok=True)
+        # Size of the store as seen by this process. Writes from other processes are
+        # only counted on the next scan, which happens when this estimate exceeds the bound.
+        self.size       = sum(size for _, size, _ in self._scan())
+
+    def key(self, *parts) -> str:
+        '''
+        Hash [parts] (np.ndarray, bytes or anything with a stable repr) to a key.
+        '''
+        h = hashlib.blake2b(digest_size=20)
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                h.update(repr((part.shape, part.dtype.str)).encode())
+                h.update(np.ascontiguousarray(part).data)
+            elif isinstance(part, (bytes, bytearray, memoryview)):
+                h.update(part)
+            else:
+                h.update(repr(part).encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        '''
+        :return: Stored value for [key] or None.
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = file.read()
+            os.utime(path) # mark as recently used
+        except FileNotFoundError: # missing or evicted meanwhile
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: bytes):
+        '''
+        Store [value] for [key], then evict old entries if the store is too large.
+        '''
+        folder = os.path.dirname(self._path(key))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=self._tmp_prefix)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(value)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        self.writes += 1
+        self.size   += len(value)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self, target: float = 0.9):
+        '''
+        Remove least recently used entries until the store uses at most [target] of max size.
+        '''
+        entries = sorted(self._scan())
+        total   = sum(size for _, size, _ in entries)
+        limit   = self.max_size * target
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError: # removed by another process
+                pass
+            total -= size
+        self.size = total
+
+    def clear(self):
+        for _, _, path in self._scan():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.size = 0
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'hit_rate'  : self.hits / requests if requests else 0.0,
+            'writes'    : self.writes,
+            'evictions' : self.evictions,
+            'size'      : self.size,
+            'max_size'  : self.max_size,
+        }
+
+    def _scan(self):
+        '''
+        Yield (mtime, size, path) of every entry. Remove stale temporary files (left by crashed writers).
+        '''
+        stale = time.time() - 3600
+        for folder in os.scandir(self.root):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                try:
+                    stat = entry.stat()
+                    if entry.name.startswith(self._tmp_prefix):
+                        if stat.st_mtime < stale:
+                            os.remove(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
@@ -1,6 +1,9 @@
-import cv2
 import numpy as np
 
+def psnr(origin: np.ndarray, restore: np.ndarray, peak: float = 255.0) -> float:
+    mse = np.mean((np.float64(origin) - np.float64(restore)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(peak * peak / mse)
+
 class CompressorAnalysis(object):
     '''
     Compare between original image with its compressed image.
@@ -12,11 +15,11 @@ class CompressorAnalysis(object):
         
         # self.quality            = quality
         self.compressed_size    = compressed_size
-        self.psnr               = cv2.PSNR(origin, restore)
+        self.psnr               = psnr(origin, restore)
 
         luma = lambda image: 0.299 * image[:, :, 2] + 0.587 * image[:, :, 1] + 0.114 * image[:, :, 0]
         self.is_color         = len(origin.shape) == 3 and origin.shape[2] == 3
-        self.luma_psnr          = cv2.PSNR(luma(origin), luma(restore)) if self.is_color else self.psnr
+        self.luma_psnr          = psnr(luma(origin), luma(restore)) if self.is_color else self.psnr
         self.difference   = np.abs(origin - restore)
 
     def __str__(self) -> str:
@@ -34,6 +37,7 @@ class CompressorAnalysis(object):
         '''
         Show origin image, compressed image and difference image on separate windows.
         '''
+        import cv2 # GUI only
         # y, cr, cb = cv2.split(self.difference)
         titles = ['Origin', 'Compressed']#, 'Diff-Y', 'Diff-Cr', 'Diff-Cb']
         images = [self.origin, self.restore]#, y, cr, cb]
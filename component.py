@@ -1,9 +1,10 @@
-import cv2
 import numpy as np
 
+import backend
 import utils
 from bitutils import StateStream
 from block import BlockExtend, Block
+from huffman import HuffmanEncoder, HuffmanDecoder
 
 class Component(object):
     '''
@@ -11,7 +12,7 @@ class Component(object):
     '''
     def __init__(self) -> None:
         self.sampling_factor    = (1, 1)
-        self.interpolation      = cv2.INTER_AREA
+        self.interpolation      = backend.INTER_AREA
         self.quantization_table = None
         self.huffman_tables     = None
         self.quality            = 50
@@ -19,52 +20,146 @@ class Component(object):
     def set_quality(self, quality: int):
         self.quality = quality
 
-    def preencode(self, data: np.ndarray, max_sfactor, mode = 'non-interleave') -> np.ndarray:
+    def preencode(self, data: np.ndarray, max_sfactor, mode = 'non-interleave', sampled: bool = False) -> np.ndarray:
         '''
         Perform Downsampling and Padding (to proper size) on [data].
+        [sampled]: [data] is already downsampled (see utils.calculate_sampling_size()), only pad it.
         '''
-        sh, sw = utils.calculate_sampling_size(data.shape[:2], self.sampling_factor, max_sfactor)
-        sampling = cv2.resize(data, (sw, sh), interpolation=self.interpolation) # down sampling
+        if sampled:
+            sampling = data
+            sh, sw = data.shape[:2]
+        else:
+            sh, sw = utils.calculate_sampling_size(data.shape[:2], self.sampling_factor, max_sfactor)
+            sampling = backend.resize(data, (sw, sh), self.interpolation) # down sampling
         
         eh, ew = utils.calculate_padding_size((sh, sw), self.sampling_factor, mode)
-        return cv2.copyMakeBorder(sampling, 0, eh - sh, 0, ew - sw, cv2.BORDER_REPLICATE) # expand to divisible
+        return backend.pad_replicate(sampling, eh - sh, ew - sw) # expand to divisible
 
-    def encode(self, data: np.ndarray, mode: str = 'non-interleave'):
+    def encode(self, data: np.ndarray, mode: str = 'non-interleave', start: int = 0, count: int | None = None):
         '''
         Encode [data] and Yield one block's decoded data.
+        [start], [count]: Encode only the groups (MCUs) [start, start + count).
         '''
-        step      = (1, 1) if mode == 'non-interleave' else (self.sampling_factor[1], self.sampling_factor[0])
-        blockextend     = BlockExtend(step).feed(data)
+        yield from self.encode_coefficients(self.transform(data, mode, start, count), mode)
+
+    def encode_coefficients(self, coefs: np.ndarray, mode: str = 'non-interleave', start: int = 0, count: int | None = None):
+        '''
+        Entropy encode quantized [coefs] (see transform()) and Yield one block's encoded data. See encode().
+        '''
+        group_size  = 1 if mode == 'non-interleave' else self.sampling_factor[0] * self.sampling_factor[1]
+        end         = len(coefs) if count is None else min((start + count) * group_size, len(coefs))
+        encoder     = HuffmanEncoder(*self.huffman_tables)
+        pred        = 0
+        for row in coefs[start * group_size:end]:
+            zigzag = row.tolist()
+            yield encoder.encode_zigzag(zigzag, pred)
+            pred = zigzag[0]
+
+    def decode(self, stream: StateStream, coefs: np.ndarray, last: np.ndarray):
+        '''
+        Entropy decode [stream] into [coefs] (see create_coefficients()) and the zigzag index of the last nonzero
+        coef of each block into [last] (see Block.itransform_all()). Decode one block per iteration.
+        '''
+        decoder = HuffmanDecoder(*self.huffman_tables)
+        pred    = 0
+        for index, row in enumerate(coefs):
+            pred, last[index] = decoder.decode_into(stream, row, pred)
+            yield
+
+    def transform(self, data: np.ndarray, mode: str = 'non-interleave', start: int = 0, count: int | None = None) -> np.ndarray:
+        '''
+        Quantized DCT coefficients (zigzag order) of all blocks of [data], one row per block.
+        [start], [count]: Only the blocks of groups (MCUs) [start, start + count). All blocks are transformed at once.
+        '''
+        rows, cols  = self._get_block_positions(data.shape, mode, start, count)
+        blocks      = np.float32(data).reshape(data.shape[0] >> 3, 8, data.shape[1] >> 3, 8)[rows, :, cols]
+        return self._quantize(backend.dct(blocks))
+
+    def quantize(self, dct: np.ndarray, mode: str = 'non-interleave') -> np.ndarray:
+        '''
+        Quantized coefficients (as transform()) from the blockwise DCT of the component data (see utils.blockwise_dct()).
+        '''
+        rows, cols  = self._get_block_positions((dct.shape[0] << 3, dct.shape[1] << 3), mode)
+        return self._quantize(dct[rows, cols])
 
-        quanttable = self.quantization_table.scale(utils.compute_scale_factor(self.quality))
-        blockencoder = Block(*self.huffman_tables, quanttable, 'encode')
-        pred         = 0
+    def _get_block_positions(self, size, mode: str, start: int = 0, count: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        (rows, columns) of the blocks of groups (MCUs) [start, start + count) in stream order. See BlockExtend.
+        '''
+        step        = (1, 1) if mode == 'non-interleave' else (self.sampling_factor[1], self.sampling_factor[0])
+        group_size  = step[0] * step[1]
+        rows, cols  = BlockExtend(step).build(size).positions()
+        end         = len(rows) if count is None else min((start + count) * group_size, len(rows))
+        return rows[start * group_size:end], cols[start * group_size:end]
 
-        while not blockextend.end():
-            benc, pred  = blockencoder.encode(blockextend.get_next(), pred)
-            yield benc
+    def _quantize(self, dct: np.ndarray) -> np.ndarray:
+        quanttable  = self.quantization_table.scale(utils.compute_scale_factor(self.quality))
+        blocks      = np.int32(dct / quanttable.table)
+        return blocks.reshape(-1, 64)[:, utils.NaturalIndex]
 
-    def decode(self, stream: StateStream, mode = 'non-interleave'):
+    def reconstruct(self, coefs: np.ndarray, shape, max_sfactor, mode: str = 'non-interleave',
+                    window: tuple | None = None, last: np.ndarray | None = None) -> np.ndarray:
         '''
-        Decode [stream] and Yield one block data
+        Restore component data (before cropping) from its coefficients. See transform().
+        [window]: Restore only the blocks in window (see get_block_window()), the result starts at its first block.
+        [last]: Last nonzero coef of each block, if recorded by decode().
         '''
-        pred            = 0
-        quanttable = self.quantization_table.scale(utils.compute_scale_factor(self.quality))
-        blockdecoder = Block(*self.huffman_tables, quanttable, 'decode')
+        container   = self.create_block_container(shape, max_sfactor, mode)
+        quanttable  = self.quantization_table.scale(utils.compute_scale_factor(self.quality))
+        transformer = Block(*self.huffman_tables, quanttable, 'decode')
+        if window is None:
+            return container.put_all(transformer.itransform_all(coefs, last)).get_all()
 
-        while not stream.end():
-            bdec, pred   = blockdecoder.decode(stream, pred)
-            yield bdec
+        top, left, bottom, right = window
+        rows, cols  = container.positions()
+        mask        = self.block_mask(shape, max_sfactor, mode, window)
+        grid        = np.zeros((bottom - top, right - left, 8, 8), dtype=container.raw.dtype)
+        grid[rows[mask] - top, cols[mask] - left] = transformer.itransform_all(coefs[mask], None if last is None else last[mask])
+        return grid.transpose(0, 2, 1, 3).reshape((bottom - top) << 3, (right - left) << 3)
 
-    def postdecode(self, data: np.ndarray, max_sampling_factor, original_shape) -> np.ndarray:
+    def get_block_window(self, roi: tuple, max_sfactor, original_shape) -> tuple:
+        '''
+        Blocks (first row, first column, end row, end column) needed to restore [roi] (y, x, h, w) of the image.
+        '''
+        ssize   = utils.calculate_sampling_size(original_shape, self.sampling_factor, max_sfactor)
+        window  = []
+        for start, length, src, dst in zip(roi[:2], roi[2:], ssize, original_shape):
+            scale   = src / dst
+            # samples under the first and the last pixel, with a margin for the interpolation
+            first   = max(int(np.floor((start + 0.5) * scale - 0.5)) - 2, 0)
+            last    = min(int(np.ceil((start + length - 0.5) * scale - 0.5)) + 3, src)
+            window.append((first >> 3, -(-last >> 3)))
+        return window[0][0], window[1][0], window[0][1], window[1][1]
+
+    def block_mask(self, shape, max_sfactor, mode: str, window: tuple) -> np.ndarray:
+        '''
+        Which blocks (in coefficients order, see create_coefficients()) are in [window].
+        '''
+        rows, cols = self.create_block_container(shape, max_sfactor, mode).positions()
+        top, left, bottom, right = window
+        return (rows >= top) & (rows < bottom) & (cols >= left) & (cols < right)
+
+    def postdecode(self, data: np.ndarray, max_sampling_factor, original_shape,
+                   roi: tuple | None = None, origin: tuple = (0, 0)) -> np.ndarray:
         '''
         Perform Cropping (remove padding) and Upsampling on [data]
+        [roi]: Upsample only roi (y, x, h, w) of the image. [data] starts at sample [origin] (y, x).
         '''
         sh, sw = utils.calculate_sampling_size(original_shape, self.sampling_factor, max_sampling_factor)
-        crop = data[:sh, :sw] # remove padding
+        crop = data[:sh - origin[0], :sw - origin[1]] # remove padding
         height, width = original_shape
-        return cv2.resize(np.uint8(crop), (width, height), interpolation=self.interpolation) # up sampling
+        if roi is None:
+            return backend.resize(np.uint8(crop), (width, height), self.interpolation) # up sampling
+        return backend.resize_region(np.uint8(crop), origin, (sh, sw), (width, height), roi, self.interpolation)
     
+    def create_coefficients(self, shape, max_sfactor, mode = 'non-interleave') -> np.ndarray:
+        '''
+        Create zero coefficients (zigzag order, one row per block) for component of image [shape]
+        '''
+        ssize = utils.calculate_sampling_size(shape, self.sampling_factor, max_sfactor)
+        esize = utils.calculate_padding_size(ssize, self.sampling_factor, mode)
+        return np.zeros(((esize[0] * esize[1]) >> 6, 64), dtype=np.int16)
+
     def create_block_container(self, shape, max_sfactor, mode = 'non-interleave'):
         '''
         Create a Block Container used for Rearrange blocks
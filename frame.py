@@ -1,12 +1,21 @@
-import cv2
+import copy
+import hashlib
+from concurrent.futures import Executor
+
 import numpy as np
 from bitarray import bitarray
 
 from bitutils import StateStream
+import backend
 from component import Component
+from huffman import ProgressiveHuffmanEncoder, ProgressiveHuffmanDecoder
 from table import *
+import reader
 import utils
 
+# Configuration (see create_frame()) and its defaults
+FRAME_CONFIG = {'quality': 50, 'sampling_factor': 420, 'interpolation': 'linear', 'progressive': False, 'restart_interval': 0}
+
 class Frame(object):
     '''
     Codecs for each Frame
@@ -16,6 +25,9 @@ class Frame(object):
         #     raise NotImplemented('Support Baseline JPEG only.')
         self.precision              = precision
         self.components             = [Component() for _ in range(max_components)]
+        self.cache                  = None
+        self.progressive            = False
+        self.restart_interval       = 0
 
         lumaquant, chromaquant      = get_suggest_quant_table()
         lumahuff                    = get_suggest_luma_huffman_table()
@@ -44,10 +56,12 @@ class Frame(object):
 
     def set_interpolation(self, name: str | list):
         '''
-        Set Sampling Strategy from name. See cv2.INTER_
-        Support: 'nearest', 'linear', 'cubic', 'area', 'lanczos4', 'nearest-exact', 'linear-exact', 'max'
+        Set Sampling Strategy from name. See backend.INTER_
+        Support: 'nearest', 'linear', 'area' with every backend.
+        'cubic', 'lanczos4', 'linear-exact', 'nearest-exact', 'max' need the OpenCV backend (ValueError otherwise).
+        Region decode (decode(..., roi=)) supports 'nearest', 'linear', 'area' only.
         '''
-        name_list = ['nearest', 'linear', 'cubic', 'area', 'lanczos4', 'nearest-exact', 'linear-exact', 'max']
+        name_list = ['nearest', 'linear', 'cubic', 'area', 'lanczos4', 'linear-exact', 'nearest-exact', 'max']
         interps = []
         if isinstance(name, str):
             name = [name]
@@ -57,6 +71,10 @@ class Frame(object):
                 interps.append(name_list.index(n))
             else:
                 interps.append(1)
+        supported = backend.get_backend().interpolations
+        for n, i in zip(name, interps):
+            if i not in supported:
+                raise ValueError(f'Interpolation {n} is not supported by the {backend.get_backend().name} backend')
         comp_interps = utils.broadcast(interps, len(self.components))
         for t, comp in zip(comp_interps, self.components):
             comp.interpolation = t
@@ -75,7 +93,7 @@ class Frame(object):
         Support: 4:A:0 or 4:A:A and 4 is divisible by A.
         '''
         if isinstance(factor, str):
-            factor = int(factor[::2])
+            factor = utils.parse_sampling_format(factor)
         if isinstance(factor, int):
             factor = utils.get_sampling_factor(factor)
 
@@ -83,6 +101,42 @@ class Frame(object):
         for t, comp in zip(comp_factors, self.components):
             comp.sampling_factor = t
 
+    def set_progressive(self, scans: bool | list = True):
+        '''
+        Use progressive mode with scan script [scans] (see utils.get_progressive_scans). True for the suggested script.
+        False for sequential mode.
+        '''
+        self.progressive = scans
+
+    def set_restart_interval(self, interval: int):
+        '''
+        Insert a restart marker after every [interval] MCUs (0 to disable) in sequential mode.
+        In "non-interleave" mode a MCU is one block and each component starts a new interval.
+        Intervals (segments) are byte aligned and can be encoded/decoded independently.
+        '''
+        self.restart_interval = interval
+
+    def set_cache(self, cache):
+        '''
+        Set a cache (see cache.EncodeCache) for encoded and decoded results. None to disable.
+        '''
+        self.cache = cache
+
+    def fingerprint(self) -> bytes:
+        '''
+        Digest of all configurations that affect the encoded/decoded data.
+        '''
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((backend.get_backend().name, self.precision, len(self.components),
+                       self.progressive, self.restart_interval)).encode())
+        for comp in self.components:
+            h.update(repr((comp.quality, tuple(comp.sampling_factor), comp.interpolation)).encode())
+            quant = np.ascontiguousarray(comp.quantization_table.table)
+            h.update(quant.dtype.str.encode() + quant.tobytes())
+            for table in comp.huffman_tables:
+                h.update(bytes(table.bits) + bytes(table.symbols))
+        return h.digest()
+
     def _get_orders(self, components: list[Component]) -> list:
         '''
         Get component's blocks order in "interleave" encode/decode mode.
@@ -92,6 +146,25 @@ class Frame(object):
             orders.extend([index] * (comp.sampling_factor[0] * comp.sampling_factor[1]))
         return orders
 
+    def _get_group_size(self, comp: Component, mode: str) -> int:
+        '''
+        Number of blocks of [comp] in one MCU.
+        '''
+        return 1 if mode == 'non-interleave' else comp.sampling_factor[0] * comp.sampling_factor[1]
+
+    def get_segments(self, group_counts: list[int], mode: str) -> list[list[tuple]]:
+        '''
+        Split the MCUs into restart intervals (one interval if restart is disabled).
+        [group_counts]: number of groups (MCUs) of each component.
+        :return: For each interval, list of (component index, first group, number of groups).
+        '''
+        if mode == 'non-interleave':
+            return [[(index, start, min(self.restart_interval or count, count - start))]
+                    for index, count in enumerate(group_counts) for start in range(0, count, self.restart_interval or count)]
+        count = group_counts[0]
+        return [[(index, start, min(self.restart_interval or count, count - start)) for index in range(len(group_counts))]
+                for start in range(0, count, self.restart_interval or count)]
+
     def _get_max_sampling_factor(self, components: list[Component]) -> tuple:
         r = [0, 0]
         for comp in components:
@@ -103,87 +176,380 @@ class Frame(object):
         '''
         Encode image data to byte array
         '''
+        if self.cache is None:
+            return self._encode(data, mode)
+        key = self.cache.key('encode', self.fingerprint(), mode, data)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._encode(data, mode)
+            self.cache.put(key, result)
+        return result
+
+    def decode(self, data: bytes, image_shape: tuple, *, mode: str = 'non-interleave', roi: tuple | None = None) -> np.ndarray:
+        '''
+        Decode byte array into image data
+        [roi]: Decode only region (y, x, height, width) of the image (clipped to the image).
+        Blocks outside the region are not restored and, with restart markers, segments without
+        blocks of the region are not entropy decoded.
+        '''
+        if roi is not None:
+            y, x    = max(roi[0], 0), max(roi[1], 0)
+            roi     = (y, x, min(roi[0] + roi[2], image_shape[0]) - y, min(roi[1] + roi[3], image_shape[1]) - x)
+            if roi[2] <= 0 or roi[3] <= 0:
+                raise ValueError(f'Region {roi} is empty or outside of image {tuple(image_shape[:2])}')
+        if self.cache is None:
+            return self._decode(data, image_shape, mode, roi)
+        key = self.cache.key('decode', self.fingerprint(), mode, tuple(image_shape), roi, data)
+        result = self.cache.get(key)
+        if result is None:
+            image = self._decode(data, image_shape, mode, roi)
+            self.cache.put(key, image.tobytes())
+            return image
+        shape = tuple(image_shape) if roi is None else roi[2:] + tuple(image_shape[2:])
+        return np.frombuffer(bytearray(result), dtype=np.uint8).reshape(shape)
+
+    def _encode(self, data: np.ndarray, mode: str) -> bytes:
+        return self._encode_preencoded(*self.preencode(data, mode))
+
+    def _encode_preencoded(self, component_data: list[np.ndarray], mode: str) -> bytes:
+        if self.progressive:
+            return self._encode_progressive([comp.transform(data) for comp, data in zip(self.components, component_data)])
+        return self._encode_sequential(component_data, mode)
+
+    def encode_coefficients(self, coefs: list[np.ndarray], *, mode: str = 'non-interleave') -> bytes:
+        '''
+        Entropy encode the quantized coefficients of each component (see decode_coefficients()).
+        No transform: the coefficients are coded as they are.
+        '''
+        if len(coefs) == 1 or self.progressive:
+            mode = 'non-interleave'
+        if self.progressive:
+            return self._encode_progressive(coefs)
+        return self._encode_sequential(coefs, mode, coefficients=True)
+
+    def _encode_sequential(self, component_data: list[np.ndarray], mode: str, coefficients: bool = False) -> bytes:
+        '''
+        Encode preencoded [component_data] (or quantized coefficients if [coefficients]) in sequential mode.
+        '''
+        if self.restart_interval:
+            return self.join_segments(self.encode_segments(component_data, mode, coefficients=coefficients))
+
+        ### Encode: (non-interleave) one segment per component or (interleave) one segment ###
+        components  = self.components[:len(component_data)]
+        group_counts = [(d.size >> 6) // self._get_group_size(c, mode) for c, d in zip(components, component_data)]
+        result      = bitarray()
+        for segment in self.get_segments(group_counts, mode):
+            result.extend(self._encode_segment(component_data, mode, segment, coefficients))
+        return result.tobytes()
+
+    def preencode(self, data: np.ndarray, mode: str = 'non-interleave') -> tuple[list[np.ndarray], str]:
+        '''
+        Convert color space, Divide components, Downsampling, Padding and Level Shift image [data].
+        :return: Data of each component and the mode actually used.
+        '''
         ### Color space convert -> Divide Components ###
         image_type         = 'color' if (len(data.shape) == 3 and data.shape[2] == 3) else 'grey'
         if image_type == 'color':
-            ycrcb = cv2.cvtColor(data, cv2.COLOR_BGR2YCrCb)
-            component_data  = cv2.split(ycrcb)
-            components      = self.components[:3]
+            ycrcb = backend.bgr2ycrcb(data)
+            component_data  = backend.split(ycrcb)
         else: # grey
             component_data  = (data,)
-            components      = self.components[:1]
-            mode            = 'non-interleave'
+        return self.preencode_components(component_data, mode)
+
+    def preencode_components(self, component_data: list[np.ndarray], mode: str = 'non-interleave',
+                             sampled: bool = False) -> tuple[list[np.ndarray], str]:
+        '''
+        Downsampling, Padding and Level Shift data of each component (Y, Cr, Cb or grey). See preencode().
+        [sampled]: data is already downsampled, see Component.preencode().
+        '''
+        components      = self.components[:len(component_data)]
+        if len(components) == 1 or self.progressive:
+            mode        = 'non-interleave'
         
         max_sfactor = self._get_max_sampling_factor(components)
 
         ### Downsampling, Padding -> Level Shift ###
-        encode_generators = []
+        level_shifted = []
         for component, data in zip(components, component_data):
-            pre_data            = component.preencode(data, max_sfactor, mode)
+            pre_data            = component.preencode(data, max_sfactor, mode, sampled)
             ### Level Shift ###
-            ls = np.array(pre_data, dtype=np.int32) - (1 << (self.precision - 1))
-            encode_generators.append(component.encode(ls, mode)) # append a encode generator
+            level_shifted.append(np.array(pre_data, dtype=np.int32) - (1 << (self.precision - 1)))
+
+        return level_shifted, mode
+
+    def encode_segments(self, component_data: list[np.ndarray], mode: str, indices: list[int] | None = None,
+                        coefficients: bool = False) -> list[bytes]:
+        '''
+        Encode restart intervals (see get_segments()) of preencoded [component_data].
+        [indices]: Intervals to encode, all if None.
+        [coefficients]: [component_data] are quantized coefficients (see decode_coefficients()).
+        :return: Entropy-coded segments (byte stuffed), to be joined by join_segments().
+        '''
+        components  = self.components[:len(component_data)]
+        group_counts = [(d.size >> 6) // self._get_group_size(c, mode) for c, d in zip(components, component_data)]
+        segments    = self.get_segments(group_counts, mode)
+        if indices is not None:
+            segments = [segments[i] for i in indices]
+        return [reader.make_ecs(self._encode_segment(component_data, mode, segment, coefficients)) for segment in segments]
+
+    def join_segments(self, segments: list[bytes]) -> bytes:
+        '''
+        Join entropy-coded segments with restart markers RST0..RST7.
+        '''
+        result = bytearray(segments[0] if segments else b'')
+        for index, segment in enumerate(segments[1:]):
+            result += reader.make_segment(reader.RST0 + (index & 7))
+            result += segment
+        return bytes(result)
+
+    def _encode_segment(self, component_data: list[np.ndarray], mode: str, segment: list[tuple],
+                        coefficients: bool = False) -> bitarray:
+        encode_generators = {}
+        for index, start, count in segment:
+            comp = self.components[index]
+            encode = comp.encode_coefficients if coefficients else comp.encode
+            encode_generators[index] = encode(component_data[index], mode, start, count)
 
         ### Encode ###
         result = bitarray()
         if mode == 'non-interleave':
-            for gen in encode_generators:
+            for gen in encode_generators.values():
                 for encoded_data in gen:
                     result.extend(encoded_data)
         else:
-            orders = self._get_orders(components)
-            try:
-                while True:
-                    for index in orders:
-                        result.extend(next(encode_generators[index]))
-            except: # end
-                pass
+            orders = self._get_orders(self.components[:len(component_data)])
+            for _ in range(segment[0][2]):
+                for index in orders:
+                    result.extend(next(encode_generators[index]))
+        return result
 
-        return result.tobytes()
+    def encode_pyramid(self, data: np.ndarray, scales: list[int] = (1, 2, 4, 8), qualities: int | list | None = None, *,
+                       mode: str = 'non-interleave', dct_domain: bool = False, executor: Executor | None = None) -> list[tuple[bytes, tuple]]:
+        '''
+        Encode renditions of image [data] reduced by each of [scales] (size: ceil(size / scale)) with [qualities]
+        (one per rendition, current quality if None).
+        Color space is converted once. Each level is downsampled (area) from the previous level, or with [dct_domain]
+        (scales 1, 2, 4, 8 only) from the DCT of the full resolution rendition: that DCT is computed once, quantized for
+        the full resolution and its low frequencies restore the downsampled components of the other levels.
+        Renditions are encoded by [executor] (e.g. a ProcessPoolExecutor kept by the caller) or here if None.
+        :return: (encoded data, image shape) of each rendition.
+        '''
+        if dct_domain and any(scale not in (1, 2, 4, 8) for scale in scales):
+            raise ValueError('DCT domain downscaling supports scales 1, 2, 4, 8 only')
+        ### Color space convert -> Divide Components (once) ###
+        image_type      = 'color' if (len(data.shape) == 3 and data.shape[2] == 3) else 'grey'
+        planes          = backend.split(backend.bgr2ycrcb(data)) if image_type == 'color' else [data]
+        height, width   = data.shape[:2]
+        sizes           = {scale: (-(-height // scale), -(-width // scale)) for scale in set(scales) | {1}}
+
+        ### Pyramid: (component data, stage) of each level. See _encode_rendition() ###
+        if dct_domain:
+            ### Full resolution: Downsampling, Padding, Level Shift -> DCT (once) ###
+            preencoded, mode = self.preencode_components(planes, mode)
+            coefs       = [utils.blockwise_dct(p) for p in preencoded]
+            components  = self.components[:len(planes)]
+            max_sfactor = self._get_max_sampling_factor(components)
+            levels      = {1: (coefs, 'dct')}
+            for scale in set(scales) - {1}:
+                levels[scale] = ([utils.downscale_dct(c, scale,
+                                                      utils.calculate_sampling_size(sizes[scale], comp.sampling_factor, max_sfactor),
+                                                      self.precision) for c, comp in zip(coefs, components)], 'sampled')
+        else:
+            levels      = {1: (planes, 'planes')}
+            previous    = planes
+            for scale in sorted(set(scales) - {1}):
+                size            = sizes[scale]
+                previous        = [backend.resize(p, (size[1], size[0]), backend.INTER_AREA) for p in previous]
+                levels[scale]   = (previous, 'planes')
 
-    def decode(self, data: bytes, image_shape: tuple, *, mode: str = 'non-interleave') -> np.ndarray:
+        ### Encode renditions ###
+        qualities       = utils.broadcast(list(qualities) if isinstance(qualities, (list, tuple)) else qualities, len(scales))
+        frames          = []
+        for quality in qualities:
+            frame = copy.deepcopy(self)
+            if quality is not None:
+                frame.set_quality(quality)
+            frames.append(frame)
+        renditions      = [levels[scale][0] for scale in scales]
+        stages          = [levels[scale][1] for scale in scales]
+        modes           = [mode] * len(scales)
+        encoded         = list((executor.map if executor is not None else map)(_encode_rendition, frames, renditions, modes, stages))
+        return [(e, sizes[scale] + data.shape[2:]) for e, scale in zip(encoded, scales)]
+
+    def decode_coefficients(self, data: bytes, image_shape: tuple, *, mode: str = 'non-interleave') -> tuple[list[np.ndarray], str]:
         '''
-        Decode byte array into image data
+        Entropy decode byte array into the quantized coefficients of each component
+        (N x 64 in zigzag order, blocks in stream order. See Component.create_coefficients()).
+        :return: Coefficients and the mode actually used.
         '''
+        components, component_shape, mode = self._get_decode_layout(image_shape, mode)
+        max_sfactor = self._get_max_sampling_factor(components)
+        if self.progressive:
+            return self._decode_progressive(data, components, component_shape, max_sfactor), mode
+        coefs, _ = self._decode_sequential(data, components, component_shape, max_sfactor, mode, [None] * len(components))
+        return coefs, mode
+
+    def _get_decode_layout(self, image_shape: tuple, mode: str) -> tuple[list[Component], tuple, str]:
+        '''
+        Components, shape of each component and the mode actually used to decode an image of [image_shape].
+        '''
+        if len(image_shape) == 3 and image_shape[2] == 3: # color
+            return self.components[:3], tuple(image_shape[:2]), 'non-interleave' if self.progressive else mode
+        return self.components[:1], tuple(image_shape), 'non-interleave'
+
+    def _decode(self, data: bytes, image_shape: tuple, mode: str, roi: tuple | None = None) -> np.ndarray:
         image_type         = 'color' if (len(image_shape) == 3 and image_shape[2] == 3) else 'grey'
-        if image_type == 'color':
-            components      = self.components[:3]
-            component_shape  = image_shape[:2]
-        else:
-            components      = self.components[:1]
-            mode            = 'non-interleave'
-            component_shape  = image_shape
+        components, component_shape, mode = self._get_decode_layout(image_shape, mode)
 
         max_sfactor = self._get_max_sampling_factor(components)
+        # blocks of each component needed for the region
+        windows     = [None] * len(components) if roi is None else \
+                      [comp.get_block_window(roi, max_sfactor, component_shape) for comp in components]
 
-        ### Decode ###
-        stream = StateStream().feed(data)
-        decode_generators = []
-        builders = []
-        for component in components:
-            decode_generators.append(component.decode(stream))
-            builders.append(component.create_block_container(component_shape, max_sfactor, mode))
-        
-        if mode == 'non-interleave':
-            for gen, builder in zip(decode_generators, builders):
-                while not builder.end():
-                    builder.put_next(next(gen))
+        if self.progressive: # last nonzero coefs are found by the reconstruction
+            coefs, lasts = self._decode_progressive(data, components, component_shape, max_sfactor), [None] * len(components)
         else:
-            orders = self._get_orders(components)
-            while not builders[0].end():
-                for index in orders:
-                    builders[index].put_next(next(decode_generators[index]))
+            coefs, lasts = self._decode_sequential(data, components, component_shape, max_sfactor, mode, windows)
+
+        ### Dequantization, IDCT -> Rearrange blocks ###
+        decoded_data = [comp.reconstruct(c, component_shape, max_sfactor, mode, window, last)
+                        for comp, c, window, last in zip(components, coefs, windows, lasts)]
 
         ### Level Shift -> Crop, Upsampling -> Merge -> Convert Color ###
         component_data = []
-        for index, comp in enumerate(components):
-            decoded     = builders[index].get_all()
+        for decoded, comp, window in zip(decoded_data, components, windows):
             ### Level Shift ###
             decoded     = np.clip(decoded + (1 << (self.precision - 1)), 0, (1 << self.precision) - 1)
-            component_data.append(comp.postdecode(decoded, max_sfactor, component_shape))
+            origin      = (0, 0) if window is None else (window[0] << 3, window[1] << 3)
+            component_data.append(comp.postdecode(decoded, max_sfactor, component_shape, roi, origin))
         
         if image_type == 'color':
-            merged = cv2.merge(component_data)
-            return cv2.cvtColor(merged, cv2.COLOR_YCrCb2BGR)
+            merged = backend.merge(component_data)
+            return backend.ycrcb2bgr(merged)
         else:
             return np.uint8(component_data[0])
+
+    def _decode_sequential(self, data: bytes, components: list[Component], component_shape, max_sfactor, mode,
+                           windows: list[tuple | None]) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        '''
+        Entropy decode byte array into the coefficients of each component (see Component.create_coefficients())
+        and the zigzag index of the last nonzero coef of each block.
+        Only decode the segments, or the start of the segment, that hold blocks in [windows] (all if None).
+        '''
+        coefs       = [comp.create_coefficients(component_shape, max_sfactor, mode) for comp in components]
+        lasts       = [np.zeros(len(c), dtype=np.int8) for c in coefs]
+        group_sizes = [self._get_group_size(comp, mode) for comp in components]
+        segments    = self.get_segments([len(c) // size for c, size in zip(coefs, group_sizes)], mode)
+
+        ### Groups to decode in each segment ###
+        limits      = [segment[0][2] for segment in segments]
+        if windows[0] is not None:
+            masks   = [comp.block_mask(component_shape, max_sfactor, mode, window).reshape(-1, size).any(axis=1)
+                       for comp, window, size in zip(components, windows, group_sizes)]
+            for position, segment in enumerate(segments):
+                # number of groups up to the last one in the windows
+                limits[position] = max(np.flatnonzero(masks[index][start:start + count]).max(initial=-1) + 1
+                                       for index, start, count in segment)
+            if not self.restart_interval:
+                # one stream: decode in full the segments before the last needed one, stop after it
+                last    = max([position for position, limit in enumerate(limits) if limit], default=0)
+                limits  = [segment[0][2] if position < last else limits[position] if position == last else 0
+                           for position, segment in enumerate(segments)]
+
+        ### Entropy decode -> Coefficients ###
+        if self.restart_interval:
+            # locate the segments (marker index), only unstuff the ones to decode
+            ecs     = [(start, end) for marker, start, end in reader.index_segments(data) if marker is None]
+            streams = [StateStream().feed(reader.read_payload(data, *position, None)) if limit else None
+                       for position, limit in zip(ecs, limits)]
+        else:
+            streams = [StateStream().feed(data)] * len(segments)
+
+        for stream, segment, limit in zip(streams, segments, limits):
+            if not limit:
+                continue
+            decode_generators = {}
+            for index, start, count in segment:
+                rows = slice(start * group_sizes[index], (start + limit) * group_sizes[index])
+                decode_generators[index] = components[index].decode(stream, coefs[index][rows], lasts[index][rows])
+            if mode == 'non-interleave':
+                for gen in decode_generators.values():
+                    for _ in gen:
+                        pass
+            else:
+                orders = self._get_orders(components)
+                for _ in range(limit):
+                    for index in orders:
+                        next(decode_generators[index])
+        return coefs, lasts
+
+    def _get_scans(self, components: list[Component]) -> list[tuple]:
+        if self.progressive is True:
+            return utils.get_progressive_scans(len(components))
+        return [scan for scan in self.progressive if scan[0] < len(components)]
+
+    def _encode_progressive(self, coefs: list[np.ndarray]) -> bytes:
+        '''
+        Encode quantized coefficients of each component (see Component.transform()) as a sequence of scans.
+        All scans are produced from the coefficients of one transform pass.
+        Each scan is [DHT] SOS ECS, see reader.make_segment().
+        '''
+        result = bytearray()
+        for index, start, end, high, low in self._get_scans(self.components[:len(coefs)]):
+            table, encoded = ProgressiveHuffmanEncoder(start, end, high, low).encode(coefs[index])
+            if table is not None:
+                table_class = 0 if start == 0 else 1 # DC or AC
+                result += reader.make_segment(reader.DHT, bytes([table_class << 4]) + table.tobytes())
+            result += reader.make_segment(reader.SOS, bytes([1, index, 0, start, end, (high << 4) | low]))
+            result += reader.make_ecs(encoded)
+        result += reader.make_segment(reader.EOI)
+        return bytes(result)
+
+    def _decode_progressive(self, data: bytes, components: list[Component], component_shape, max_sfactor) -> list[np.ndarray]:
+        '''
+        Decode the scans in byte array into the coefficients of each component.
+        [data] may be truncated (partially received): the image is restored from the available scans.
+        '''
+        coefs = [comp.create_coefficients(component_shape, max_sfactor) for comp in components]
+
+        table       = None
+        segments    = reader.parse_segments(data)
+        for position, (marker, payload) in enumerate(segments):
+            if marker == reader.DHT:
+                table = HuffmanTable.frombytes(payload[1:])
+            elif marker == reader.SOS:
+                index, start, end, approx = payload[1], payload[3], payload[4], payload[5]
+                following = segments[position + 1] if position + 1 < len(segments) else (reader.EOI, b'')
+                if following[0] is not None or index >= len(components): # no data for this scan
+                    continue
+                decoder = ProgressiveHuffmanDecoder(table, start, end, approx >> 4, approx & 0x0F)
+                decoder.decode(StateStream().feed(following[1]), coefs=coefs[index])
+                table = None
+        return coefs
+
+def create_frame(config: dict, warm_up: bool = True) -> Frame:
+    '''
+    Frame configured by [config] (keys of FRAME_CONFIG, missing ones keep the defaults).
+    [warm_up]: run the whole pipeline once on a tiny image, e.g. in a worker process before its first job.
+    '''
+    config = {**FRAME_CONFIG, **config}
+    frame  = Frame()
+    frame.set_quality(config['quality'])
+    frame.set_sampling_factor(config['sampling_factor'])
+    frame.set_interpolation(config['interpolation'])
+    frame.set_progressive(config['progressive'])
+    frame.set_restart_interval(config['restart_interval'])
+    if warm_up:
+        warm = np.zeros((16, 16, 3), dtype=np.uint8)
+        frame.decode(frame.encode(warm), warm.shape)
+    return frame
+
+def _encode_rendition(frame: Frame, component_data: list[np.ndarray], mode: str, stage: str = 'planes') -> bytes:
+    '''
+    Encode [component_data] of one rendition, which is at [stage]:
+    'planes' (full size components), 'sampled' (downsampled components) or 'dct' (blockwise DCT of preencoded components).
+    '''
+    if stage == 'dct':
+        components = frame.components[:len(component_data)]
+        return frame.encode_coefficients([comp.quantize(c, mode) for comp, c in zip(components, component_data)], mode=mode)
+    return frame._encode_preencoded(*frame.preencode_components(component_data, mode, sampled=(stage == 'sampled')))
@@ -24,7 +24,7 @@
 
 from bitarray import bitarray, util
 import numpy as np
-from utils import fromlist_zigzag, tolist_zigzag
+from utils import tolist_zigzag
 
 from bitutils import StateStream, JpegBitConverter
 from table import HuffmanTable
@@ -117,8 +117,12 @@ class HuffmanEncoder(Encoder):
         self.ac_lookup = _EncoderLookup(ac_table)
 
     def encode(self, data: np.ndarray, **params) -> bitarray:
-        pred = params['pred']
-        coefs = tolist_zigzag(data) # data.tolist_zigzag() ### Change here
+        return self.encode_zigzag(tolist_zigzag(data), params['pred']) # data.tolist_zigzag() ### Change here
+
+    def encode_zigzag(self, coefs: list[int], pred: int) -> bitarray:
+        '''
+        Encode one block given as 64 coefs in zigzag order.
+        '''
         result = bitarray()
         ######## Encode DC ########
         diff = coefs[0] - pred
@@ -153,16 +157,20 @@ class HuffmanDecoder(Decoder):
     def __init__(self, dc_table: HuffmanTable, ac_table: HuffmanTable) -> None:
         self.dc_lookup = _DecoderLookup(dc_table)
         self.ac_lookup = _DecoderLookup(ac_table)
-    
-    def decode(self, stream: StateStream, **params) -> np.ndarray:
+
+    def decode_into(self, stream: StateStream, coefs: np.ndarray, pred: int) -> tuple[int, int]:
+        '''
+        Decode one block from [stream] into [coefs] (64, zigzag order, all zero). Only nonzero coefs are written.
+        :return: The DC coef (predictor for next block) and the zigzag index of the last nonzero coef.
+        '''
         number_of_coefs     = 64
-        coefs               = [0] * number_of_coefs
-        pred                = params['pred']
         ######## Decode DC ########
         precision = self.dc_lookup.get_symbol(stream) # number of bits represent the diff
         diff = 0 if precision == 0 else JpegBitConverter.bits2int(stream.next_bits(precision))
-        coefs[0] = pred + diff
+        dc = pred + diff
+        coefs[0] = dc
         ######## Decode AC ########
+        last = 0
         k = 1 # index in coefs
         while k < number_of_coefs:
             rs = self.ac_lookup.get_symbol(stream) # run length || number of bits represent the coef
@@ -171,8 +179,247 @@ class HuffmanDecoder(Decoder):
             k += zrl
             if precision > 0:
                 coefs[k] = JpegBitConverter.bits2int(stream.next_bits(precision))
+                last = k
             elif zrl != 0xF: # Not zero runlength
                 break
             k += 1
+        return dc, last
+
+class ProgressiveHuffmanEncoder(Encoder):
+    '''
+    Encoder for one progressive scan of one component.
+    Spectral selection: coefs [start, end] (zigzag index). Successive approximation: bit position [high], [low].
+    The Huffman Table is generated from the statistics of the scan itself (EOBn symbols are not in the suggested tables).
+    '''
+    max_eobrun          = 0x7FFF
+    max_correction_bits = 937 # flush long EOB runs so the pending correction bits stay bounded
+
+    def __init__(self, start: int, end: int, high: int, low: int) -> None:
+        super().__init__()
+        self.start, self.end    = start, end
+        self.high, self.low     = high, low
+        self.lookup             = None
+        self.frequencies        = None
+
+    def encode(self, data: np.ndarray, **params) -> tuple[HuffmanTable | None, bitarray]:
+        '''
+        Encode [data]: the coefficients (zigzag order) of all blocks, one row per block.
+        :return: The Huffman Table (None for DC refinement scan) and the encoded scan.
+        '''
+        coefs = data[:, self.start:self.end + 1].tolist()
+        if self.start == 0 and self.high > 0: # DC refinement: one raw bit per block
+            return None, bitarray([(c[0] >> self.low) & 1 for c in coefs])
+        if self.start == 0:
+            run = self._encode_dc_first
+        elif self.high == 0:
+            run = self._encode_ac_first
+        else:
+            run = self._encode_ac_refine
+        ### Pass 1: gather statistics ###
+        self.lookup         = None
+        self.frequencies    = [0] * 256
+        run(coefs)
+        ### Pass 2: encode ###
+        table               = HuffmanTable.fromfrequencies(self.frequencies)
+        self.lookup         = _EncoderLookup(table)
+        return table, run(coefs)
+
+    def _emit(self, result: bitarray, symbol: int):
+        if self.lookup is None:
+            self.frequencies[symbol] += 1
+        else:
+            result.extend(self.lookup.get_code(symbol))
+
+    def _emit_eobrun(self, result: bitarray, eobrun: int, correction_bits: bitarray):
+        '''
+        Emit EOBn symbol for [eobrun] blocks, followed by the correction bits of those blocks.
+        '''
+        if eobrun > 0:
+            n = eobrun.bit_length() - 1
+            self._emit(result, n << 4)
+            if n > 0:
+                result.extend(util.int2ba(eobrun & ((1 << n) - 1), n))
+            result.extend(correction_bits)
+        correction_bits.clear()
+
+    def _encode_dc_first(self, coefs: list) -> bitarray:
+        result  = bitarray()
+        pred    = 0
+        for c in coefs:
+            value       = c[0] >> self.low
+            diff        = value - pred
+            pred        = value
+            category    = diff.bit_length()
+            self._emit(result, category)
+            if category > 0:
+                result.extend(JpegBitConverter.int2bits(diff))
+        return result
+
+    def _encode_ac_first(self, coefs: list) -> bitarray:
+        result  = bitarray()
+        eobrun  = 0
+        for c in coefs:
+            zrl = 0
+            for ac in c:
+                value = abs(ac) >> self.low
+                if value == 0:
+                    zrl += 1
+                    continue
+                self._emit_eobrun(result, eobrun, bitarray())
+                eobrun = 0
+                while zrl > 15:
+                    self._emit(result, 0xF0)
+                    zrl -= 16
+                self._emit(result, (zrl << 4) | value.bit_length())
+                result.extend(JpegBitConverter.int2bits(value if ac > 0 else -value))
+                zrl = 0
+            if zrl > 0:
+                eobrun += 1
+                if eobrun == self.max_eobrun:
+                    self._emit_eobrun(result, eobrun, bitarray())
+                    eobrun = 0
+        self._emit_eobrun(result, eobrun, bitarray())
+        return result
+
+    def _encode_ac_refine(self, coefs: list) -> bitarray:
+        result  = bitarray()
+        eobrun  = 0
+        pending = bitarray() # correction bits of the blocks in current EOB run
+        for c in coefs:
+            values  = [abs(ac) >> self.low for ac in c]
+            # position of the last newly-nonzero coef, run of zeros after it is coded by EOB
+            last    = max((k for k, v in enumerate(values) if v == 1), default=-1)
+            zrl     = 0
+            bits    = bitarray() # correction bits of the coefs after the last emitted symbol
+            for k, value in enumerate(values):
+                if value == 0:
+                    zrl += 1
+                    if zrl == 16 and k < last:
+                        self._emit_eobrun(result, eobrun, pending)
+                        eobrun = 0
+                        self._emit(result, 0xF0)
+                        result.extend(bits)
+                        bits.clear()
+                        zrl = 0
+                elif value > 1: # nonzero in previous scans: append its correction bit
+                    bits.append(value & 1)
+                else: # newly-nonzero: its magnitude is 1 at this bit position
+                    self._emit_eobrun(result, eobrun, pending)
+                    eobrun = 0
+                    self._emit(result, (zrl << 4) | 1)
+                    result.append(1 if c[k] > 0 else 0)
+                    result.extend(bits)
+                    bits.clear()
+                    zrl = 0
+            if zrl > 0 or len(bits) > 0:
+                eobrun += 1
+                pending.extend(bits)
+                if eobrun == self.max_eobrun or len(pending) > self.max_correction_bits:
+                    self._emit_eobrun(result, eobrun, pending)
+                    eobrun = 0
+        self._emit_eobrun(result, eobrun, pending)
+        return result
+
+class ProgressiveHuffmanDecoder(Decoder):
+    '''
+    Decoder for one progressive scan of one component. See ProgressiveHuffmanEncoder.
+    '''
+    def __init__(self, table: HuffmanTable | None, start: int, end: int, high: int, low: int) -> None:
+        self.lookup             = _DecoderLookup(table) if table is not None else None
+        self.start, self.end    = start, end
+        self.high, self.low     = high, low
+
+    def decode(self, stream: StateStream, **params) -> int:
+        '''
+        Decode [stream] into params['coefs'] (zigzag order, one row per block) in place.
+        A truncated stream is decoded up to its last complete block.
+        :return: Number of decoded blocks.
+        '''
+        coefs = params['coefs']
+        if self.start == 0:
+            decode_block = self._decode_dc_refine if self.high > 0 else self._decode_dc_first
+        else:
+            decode_block = self._decode_ac_refine if self.high > 0 else self._decode_ac_first
+        self.pred   = 0
+        self.eobrun = 0
+        for index in range(len(coefs)):
+            try:
+                block = decode_block(stream, coefs[index].tolist())
+            except IndexError: # end of stream
+                return index
+            if stream.index > len(stream):
+                return index
+            coefs[index] = block
+        return len(coefs)
+
+    def _decode_dc_first(self, stream: StateStream, block: list) -> list:
+        category    = self.lookup.get_symbol(stream)
+        diff        = 0 if category == 0 else JpegBitConverter.bits2int(stream.next_bits(category))
+        self.pred  += diff
+        block[0]    = self.pred << self.low
+        return block
+
+    def _decode_dc_refine(self, stream: StateStream, block: list) -> list:
+        block[0] |= stream.next_bit() << self.low
+        return block
+
+    def _decode_ac_first(self, stream: StateStream, block: list) -> list:
+        if self.eobrun > 0: # in an EOB run: nothing coded for this block
+            self.eobrun -= 1
+            return block
+        k = self.start
+        while k <= self.end:
+            rs          = self.lookup.get_symbol(stream)
+            zrl         = rs >> 4
+            precision   = rs & 0x0F
+            if precision > 0:
+                k += zrl
+                block[k] = JpegBitConverter.bits2int(stream.next_bits(precision)) << self.low
+            elif zrl == 0xF:
+                k += 15
+            else: # EOBn: this block and the next (eobrun - 1) blocks end here
+                self.eobrun = (1 << zrl) - 1
+                if zrl > 0:
+                    self.eobrun += util.ba2int(stream.next_bits(zrl))
+                break
+            k += 1
+        return block
+
+    def _decode_ac_refine(self, stream: StateStream, block: list) -> list:
+        positive, negative = 1 << self.low, -1 << self.low
+        k = self.start
+        if self.eobrun == 0:
+            while k <= self.end:
+                rs          = self.lookup.get_symbol(stream)
+                zrl         = rs >> 4
+                value       = 0
+                if rs & 0x0F: # newly-nonzero coef, magnitude 1 at this bit position
+                    value = positive if stream.next_bit() else negative
+                elif zrl != 0xF: # EOBn
+                    self.eobrun = 1 << zrl
+                    if zrl > 0:
+                        self.eobrun += util.ba2int(stream.next_bits(zrl))
+                    break
+                # skip [zrl] zero coefs, refine the nonzero ones on the way
+                while k <= self.end:
+                    if block[k] != 0:
+                        self._refine(stream, block, k, positive, negative)
+                    elif zrl == 0:
+                        break
+                    else:
+                        zrl -= 1
+                    k += 1
+                if value and k <= self.end:
+                    block[k] = value
+                k += 1
+        if self.eobrun > 0:
+            while k <= self.end:
+                if block[k] != 0:
+                    self._refine(stream, block, k, positive, negative)
+                k += 1
+            self.eobrun -= 1
+        return block
 
-        return fromlist_zigzag(coefs)# Block(None).fromlist_zigzag(coefs) ### Change here
\ No newline at end of file
+    def _refine(self, stream: StateStream, block: list, k: int, positive: int, negative: int):
+        if stream.next_bit() and (block[k] & positive) == 0:
+            block[k] += positive if block[k] >= 0 else negative
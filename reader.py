@@ -80,3 +80,73 @@ def get_ecs_length(path) -> int:
         except:
             pass
     return result
+
+
+########## Marker segments in memory ###########
+
+SOI, EOI, SOS, DHT, RST0 = 0xD8, 0xD9, 0xDA, 0xC4, 0xD0
+
+def make_segment(marker: int, payload: bytes = b'') -> bytes:
+    '''
+    Marker 0xFF[marker], followed by the length and [payload] for markers that have one.
+    '''
+    if get_type(marker) in ['SOI', 'EOI', 'RST']:
+        return bytes([0xFF, marker])
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+def make_ecs(bits) -> bytes:
+    '''
+    Pad [bits] (bitarray) with 1-bits to a byte boundary and stuff 0x00 after any 0xFF.
+    '''
+    padded = bits.copy()
+    padded.extend('1' * (-len(padded) % 8))
+    return padded.tobytes().replace(b'\xff', b'\xff\x00')
+
+def parse_segments(data: bytes) -> list[tuple[int | None, bytes]]:
+    '''
+    Split [data] into (marker, payload). Entropy-coded segments have marker None and are unstuffed.
+    A truncated trailing ECS is kept, a truncated trailing marker segment is dropped.
+    '''
+    return [(marker, read_payload(data, start, end, marker)) for marker, start, end in index_segments(data)]
+
+def read_payload(data: bytes, start: int, end: int, marker: int | None) -> bytes:
+    '''
+    Payload [start, end) of a segment of [data] (see index_segments()). Unstuff entropy-coded segments.
+    '''
+    if marker is None:
+        return data[start:end].replace(b'\xff\x00', b'\xff')
+    return data[start:end]
+
+def index_segments(data: bytes) -> list[tuple[int | None, int, int]]:
+    '''
+    Locate the segments of [data] without copying them: (marker, payload start, payload end).
+    Entropy-coded segments have marker None. See parse_segments().
+    '''
+    result  = []
+    index   = 0
+    size    = len(data)
+    while index < size:
+        if data[index] == 0xFF and index + 1 < size and data[index + 1] != 0:
+            marker = data[index + 1]
+            index += 2
+            if get_type(marker) in ['SOI', 'EOI', 'RST']:
+                result.append((marker, index, index))
+                continue
+            length = int.from_bytes(data[index:index + 2], 'big')
+            if index + 2 > size or index + length > size:
+                break
+            result.append((marker, index + 2, index + length))
+            index += length
+        else: # ECS: until next marker (0xFF not followed by 0x00)
+            end = index
+            while True:
+                end = data.find(b'\xff', end)
+                if end < 0 or end + 1 >= size:
+                    end = size
+                    break
+                if data[end + 1] != 0:
+                    break
+                end += 2
+            result.append((None, index, end))
+            index = end
+    return result
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from frame import Frame, create_frame
+import utils
+
+########## Worker side ###########
+# Each worker process owns one Frame, configured (and warmed) once by the pool initializer.
+# Jobs only carry the image data, never the codec state.
+
+_frame: Frame = None
+
+def _init_worker(config: dict):
+    global _frame
+    _frame = create_frame(config)
+
+def _ping() -> int:
+    return os.getpid()
+
+def _encode_job(data: np.ndarray, mode: str) -> tuple[bytes, float]:
+    start = time.perf_counter()
+    return _frame.encode(data, mode=mode), time.perf_counter() - start
+
+def _decode_job(data: bytes, image_shape: tuple, mode: str) -> tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    return _frame.decode(data, image_shape, mode=mode), time.perf_counter() - start
+
+########## Service side ###########
+
+class _Job(object):
+    def __init__(self, fn, args: tuple, future: asyncio.Future, deadline: float | None) -> None:
+        self.fn         = fn
+        self.args       = args
+        self.future     = future
+        self.deadline   = deadline
+        self.created    = time.perf_counter()
+
+def _summary(samples: deque) -> dict:
+    '''
+    Summary (in milliseconds) of the latest latency [samples] (in seconds).
+    '''
+    if not samples:
+        return {'count': 0}
+    values = np.array(samples) * 1000
+    return {
+        'count' : len(values),
+        'mean'  : float(values.mean()),
+        'p50'   : float(np.percentile(values, 50)),
+        'p95'   : float(np.percentile(values, 95)),
+        'p99'   : float(np.percentile(values, 99)),
+        'max'   : float(values.max()),
+    }
+
+class CodecService(object):
+    '''
+    Asynchronous front end for Frame.encode/decode.
+    Jobs wait in a bounded queue (backpressure) and are dispatched to a pool of worker processes,
+    each holding a warmed Frame. Every job may have a deadline and can be cancelled by its caller.
+    '''
+    def __init__(self, workers: int | None = None, queue_size: int = 64, *, quality: int | list = 50,
+                 sampling_factor: int | str | list = 420, interpolation: str | list = 'linear',
+                 progressive: bool | list = False, restart_interval: int = 0, samples: int = 1024) -> None:
+        self.workers        = workers or os.cpu_count() or 1
+        self.queue_size     = queue_size
+        self.config         = {'quality': quality, 'sampling_factor': sampling_factor, 'interpolation': interpolation,
+                               'progressive': progressive, 'restart_interval': restart_interval}
+        self.pool           = None
+        self.queue          = None
+        self.dispatchers    = []
+        # metrics
+        self.counters       = dict.fromkeys(['submitted', 'completed', 'failed', 'rejected', 'expired', 'cancelled'], 0)
+        self.in_flight      = 0
+        self.latencies      = deque(maxlen=samples) # submit -> result
+        self.waits          = deque(maxlen=samples) # submit -> dispatch
+        self.service_times  = deque(maxlen=samples) # time spent in the worker
+
+    async def start(self) -> 'CodecService':
+        '''
+        Spawn and warm up the worker processes, start the dispatchers.
+        '''
+        loop = asyncio.get_running_loop()
+        self.pool   = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.config,))
+        self.queue  = asyncio.Queue(self.queue_size)
+        # concurrent submissions force the pool to spawn (and initialize) all of its workers now
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _ping) for _ in range(self.workers)])
+        self.dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        return self
+
+    async def stop(self):
+        '''
+        Stop the dispatchers, fail the waiting jobs and shut down the worker processes.
+        '''
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.dispatchers = []
+        while self.queue is not None and not self.queue.empty():
+            job = self.queue.get_nowait()
+            if not job.future.done():
+                job.future.set_exception(RuntimeError('Service stopped'))
+        if self.pool is not None:
+            # blocking: wait for the running jobs in another thread, not in the event loop
+            pool, self.pool = self.pool, None
+            await asyncio.get_running_loop().run_in_executor(None, lambda: pool.shutdown(wait=True, cancel_futures=True))
+
+    async def __aenter__(self) -> 'CodecService':
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def encode(self, data: np.ndarray, *, mode: str = 'non-interleave',
+                     timeout: float | None = None, block: bool = True) -> bytes:
+        '''
+        Encode image data to byte array in a worker process.
+        [timeout]: deadline (seconds) for the whole request, queueing included. Raise TimeoutError.
+        [block]: wait for a free slot when the queue is full, otherwise raise asyncio.QueueFull.
+        '''
+        return await self._submit(_encode_job, (data, mode), timeout, block)
+
+    async def decode(self, data: bytes, image_shape: tuple, *, mode: str = 'non-interleave',
+                     timeout: float | None = None, block: bool = True) -> np.ndarray:
+        '''
+        Decode byte array into image data in a worker process. See encode().
+        '''
+        return await self._submit(_decode_job, (data, tuple(image_shape), mode), timeout, block)
+
+    def metrics(self) -> dict:
+        '''
+        Current queue depth, job counters and latency summaries (milliseconds).
+        '''
+        return {
+            'workers'       : self.workers,
+            'queue_depth'   : self.queue.qsize() if self.queue is not None else 0,
+            'queue_size'    : self.queue_size,
+            'in_flight'     : self.in_flight,
+            **self.counters,
+            'latency'       : _summary(self.latencies),
+            'queue_wait'    : _summary(self.waits),
+            'service_time'  : _summary(self.service_times),
+        }
+
+    async def _submit(self, fn, args: tuple, timeout: float | None, block: bool):
+        if self.queue is None:
+            raise RuntimeError('Service is not started')
+        loop        = asyncio.get_running_loop()
+        deadline    = None if timeout is None else loop.time() + timeout
+        job         = _Job(fn, args, loop.create_future(), deadline)
+        try:
+            if block:
+                await asyncio.wait_for(self.queue.put(job), timeout)
+            else:
+                self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters['rejected'] += 1
+            raise
+        except asyncio.TimeoutError:
+            self.counters['expired'] += 1
+            raise
+        self.counters['submitted'] += 1
+
+        try:
+            # on timeout or cancellation of the caller, the job future is cancelled too
+            # so the dispatchers drop it (or discard its result if it is already running)
+            remaining = None if deadline is None else max(0, deadline - loop.time())
+            result = await asyncio.wait_for(job.future, remaining)
+        except asyncio.TimeoutError:
+            self.counters['expired'] += 1
+            raise
+        except asyncio.CancelledError:
+            self.counters['cancelled'] += 1
+            raise
+        self.latencies.append(time.perf_counter() - job.created)
+        return result
+
+    async def _dispatch(self):
+        '''
+        Move jobs from the queue to the worker processes, one job at a time.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if job.future.done(): # cancelled or expired while waiting
+                continue
+            if job.deadline is not None and loop.time() >= job.deadline:
+                job.future.cancel()
+                continue
+            self.waits.append(time.perf_counter() - job.created)
+            self.in_flight += 1
+            try:
+                result, service_time = await loop.run_in_executor(self.pool, job.fn, *job.args)
+                self.service_times.append(service_time)
+                # a caller that expired or cancelled meanwhile is already counted
+                if not job.future.done():
+                    job.future.set_result(result)
+                    self.counters['completed'] += 1
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.set_exception(RuntimeError('Service stopped'))
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                    self.counters['failed'] += 1
+            finally:
+                self.in_flight -= 1
+
+########## HTTP front end ###########
+# POST /encode?shape=H,W[,3][&mode=..][&timeout=..]   body: raw uint8 pixels    -> encoded bytes
+# POST /decode?shape=H,W[,3][&mode=..][&timeout=..]   body: encoded bytes       -> raw uint8 pixels
+# GET  /metrics                                                                 -> JSON
+# The body is read only if the queue has room (503 otherwise) and is not too large (413).
+
+_status_text = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error',
+                503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+async def _respond(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str = 'application/octet-stream'):
+    head = f'HTTP/1.1 {status} {_status_text[status]}\r\nContent-Type: {content_type}\r\n' \
+           f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+async def _handle(service: CodecService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                  connections: asyncio.Semaphore, max_body_size: int):
+    if connections.locked(): # too many open connections: answer without reading the request
+        await _respond(writer, 503, b'too many connections')
+        writer.close()
+        return
+    async with connections:
+        await _handle_request(service, reader, writer, max_body_size)
+
+async def _handle_request(service: CodecService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                          max_body_size: int):
+    try:
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        url     = urlsplit(target)
+        query   = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if method == 'GET' and url.path == '/metrics':
+            return await _respond(writer, 200, json.dumps(service.metrics()).encode(), 'application/json')
+        if method != 'POST' or url.path not in ('/encode', '/decode'):
+            return await _respond(writer, 404, b'')
+
+        ### Reject before reading the body ###
+        length  = int(headers.get('content-length', 0))
+        if length > max_body_size:
+            return await _respond(writer, 413, f'body larger than {max_body_size} bytes'.encode())
+        if service.queue.full():
+            service.counters['rejected'] += 1
+            return await _respond(writer, 503, b'queue is full')
+        body    = await reader.readexactly(length)
+
+        shape   = tuple(int(s) for s in query['shape'].split(','))
+        mode    = query.get('mode', 'non-interleave')
+        timeout = float(query['timeout']) if 'timeout' in query else None
+        if url.path == '/encode':
+            image = np.frombuffer(body, dtype=np.uint8).reshape(shape)
+            result = await service.encode(image, mode=mode, timeout=timeout, block=False)
+        else:
+            result = (await service.decode(body, shape, mode=mode, timeout=timeout, block=False)).tobytes()
+        await _respond(writer, 200, result)
+    except asyncio.QueueFull:
+        await _respond(writer, 503, b'queue is full')
+    except asyncio.TimeoutError:
+        await _respond(writer, 504, b'deadline exceeded')
+    except (ValueError, KeyError) as e:
+        await _respond(writer, 400, str(e).encode())
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        await _respond(writer, 500, str(e).encode())
+    finally:
+        writer.close()
+
+async def serve(service: CodecService, host: str = '127.0.0.1', port: int = 8080, path: str | None = None, *,
+                max_body_size: int = 64 << 20, max_connections: int = 256):
+    '''
+    Serve [service] over HTTP on TCP ([host], [port]) or on a Unix socket [path]. Run forever.
+    Bodies larger than [max_body_size] bytes are rejected (413), connections above [max_connections] get 503.
+    '''
+    connections = asyncio.Semaphore(max_connections)
+    handler = lambda reader, writer: _handle(service, reader, writer, connections, max_body_size)
+    if path:
+        server = await asyncio.start_unix_server(handler, path)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    async with server:
+        await server.serve_forever()
+
+async def _main(args):
+    async with CodecService(args.workers, args.queue_size, quality=args.quality,
+                            sampling_factor=args.sampling, interpolation=args.interpolation,
+                            progressive=args.progressive, restart_interval=args.restart_interval) as service:
+        await serve(service, args.host, args.port, args.unix,
+                    max_body_size=args.max_body_mb << 20, max_connections=args.max_connections)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Encode/Decode service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', default=None, help='Unix socket path (instead of TCP)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--queue-size', type=int, default=64)
+    parser.add_argument('--max-body-mb', type=int, default=64, help='larger request bodies get 413')
+    parser.add_argument('--max-connections', type=int, default=256, help='connections above this get 503')
+    parser.add_argument('--quality', type=int, default=50)
+    parser.add_argument('--sampling', default=420, type=utils.parse_sampling_format, help='420 or 4:2:0')
+    parser.add_argument('--interpolation', default='linear')
+    parser.add_argument('--progressive', action='store_true')
+    parser.add_argument('--restart-interval', type=int, default=0)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,71 @@
+import copy
+
+import numpy as np
+
+from frame import Frame
+
+class EncoderSession(object):
+    '''
+    Stateful encoder for a sequence of similar images (screenshots, camera frames).
+    The stream has a restart marker after every column of MCUs (blocks are ordered column by column),
+    so each column is an independent segment. Only the columns that changed since the previous image
+    are transformed (DCT) and entropy coded again, the others are reused. Preencoding (color conversion,
+    downsampling, padding) still runs on the whole image, it is needed to find the changed columns.
+    The session works on a copy of [frame] with its own restart interval: decode with session.frame
+    (or a Frame with set_restart_interval(session.restart_interval)) and mode=session.mode.
+    '''
+    def __init__(self, frame: Frame | None = None) -> None:
+        self.frame      = copy.deepcopy(frame) if frame is not None else Frame()
+        self.mode       = 'interleave'
+        self.reset()
+
+    @property
+    def restart_interval(self) -> int:
+        '''
+        Restart interval (MCUs per column) of the last encoded image. Needed to decode it.
+        '''
+        return self.frame.restart_interval
+
+    def reset(self):
+        '''
+        Forget the previous image: next encode() is a full encode.
+        '''
+        self.previous   = None # preencoded data of each component
+        self.segments   = None # encoded segments (one per MCU column)
+        self.key        = None # image shape and frame configuration of the previous image
+        self.changed    = 0    # number of segments encoded by the last call
+
+    def encode(self, data: np.ndarray) -> bytes:
+        '''
+        Encode image data to byte array, reusing unchanged MCU columns of the previous image.
+        '''
+        if self.frame.progressive:
+            raise ValueError('EncoderSession supports sequential mode only')
+        component_data, self.mode = self.frame.preencode(data, 'interleave')
+        components  = self.frame.components[:len(component_data)]
+        # group (MCU) size in samples of each component: (height, width)
+        group_sizes = [(8, 8) if self.mode == 'non-interleave' else (8 * c.sampling_factor[1], 8 * c.sampling_factor[0])
+                       for c in components]
+        # one restart interval per column of MCUs
+        self.frame.set_restart_interval(component_data[0].shape[0] // group_sizes[0][0])
+
+        key = (data.shape, self.frame.fingerprint())
+        if key != self.key:
+            indices = None
+        else:
+            changed = None
+            for current, previous, (_, width) in zip(component_data, self.previous, group_sizes):
+                columns = (current != previous).any(axis=0).reshape(-1, width).any(axis=1)
+                changed = columns if changed is None else changed | columns
+            indices = np.flatnonzero(changed).tolist()
+
+        encoded = self.frame.encode_segments(component_data, self.mode, indices)
+        if indices is None:
+            self.segments = encoded
+        else:
+            for index, segment in zip(indices, encoded):
+                self.segments[index] = segment
+        self.changed    = len(encoded)
+        self.previous   = component_data
+        self.key        = key
+        return self.frame.join_segments(self.segments)
@@ -25,6 +25,65 @@ class HuffmanTable(object):
             huffvals.extend(list(bits_huffvals[current:current + b]))
             current += b
         return HuffmanTable(bits, huffvals)
+
+    def tobytes(self) -> bytes:
+        return bytes(self.bits) + bytes(self.symbols)
+
+    def fromfrequencies(frequencies: list[int]):
+        '''
+        Generate optimal Huffman Table (code length limited to 16) for symbols 0..255 from their [frequencies].
+        See JPEG Specification, Annex K.2.
+        '''
+        freq        = list(frequencies) + [1] # reserve one code point, so no code is all 1-bits
+        codesize    = [0] * 257
+        others      = [-1] * 257
+        while True:
+            # find the two least frequent symbols (the larger symbol wins ties)
+            c1 = c2 = -1
+            for i, f in enumerate(freq):
+                if f <= 0:
+                    continue
+                if c1 < 0 or f <= freq[c1]:
+                    c1, c2 = i, c1
+                elif c2 < 0 or f <= freq[c2]:
+                    c2 = i
+            if c2 < 0:
+                break
+            # merge the two trees
+            freq[c1] += freq[c2]
+            freq[c2] = 0
+            codesize[c1] += 1
+            while others[c1] >= 0:
+                c1 = others[c1]
+                codesize[c1] += 1
+            others[c1] = c2
+            codesize[c2] += 1
+            while others[c2] >= 0:
+                c2 = others[c2]
+                codesize[c2] += 1
+
+        bits = [0] * 33
+        for size in codesize:
+            if size:
+                bits[size] += 1
+        # limit code length to 16 bits
+        for i in range(32, 16, -1):
+            while bits[i] > 0:
+                j = i - 2
+                while bits[j] == 0:
+                    j -= 1
+                bits[i]     -= 2
+                bits[i - 1] += 1
+                bits[j + 1] += 2
+                bits[j]     -= 1
+        # remove the reserved code point (the longest one)
+        i = 16
+        while bits[i] == 0:
+            i -= 1
+        bits[i] -= 1
+
+        huffvals = [symbol for size in range(1, 33) for symbol in range(256) if codesize[symbol] == size]
+        return HuffmanTable(bits[1:17], huffvals)
     
 _luma_quant_q50 = [[16, 11, 10, 16, 24, 40, 51, 61],
                        [12, 12, 14, 19, 26, 58, 60, 55],
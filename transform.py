@@ -0,0 +1,109 @@
+import copy
+
+import numpy as np
+
+import utils
+from frame import Frame
+from table import QuantizationTable
+from utils import ZigZagIndex, NaturalIndex
+
+# (transpose, flip horizontally, flip vertically), applied in this order
+OPERATIONS = {
+    'none'              : (False, False, False),
+    'flip-horizontal'   : (False, True, False),
+    'flip-vertical'     : (False, False, True),
+    'rotate-180'        : (False, True, True),
+    'transpose'         : (True, False, False),
+    'rotate-90'         : (True, True, False), # clockwise
+    'rotate-270'        : (True, False, True),
+    'transverse'        : (True, True, True),
+}
+
+# Operation that brings an image with EXIF orientation tag to the normal orientation (tag 1)
+EXIF_ORIENTATIONS = {
+    1: 'none',
+    2: 'flip-horizontal',
+    3: 'rotate-180',
+    4: 'flip-vertical',
+    5: 'transpose',
+    6: 'rotate-90',
+    7: 'transverse',
+    8: 'rotate-270',
+}
+
+def transform(frame: Frame, data: bytes, image_shape: tuple, operation: str, *,
+              mode: str = 'non-interleave') -> tuple[bytes, tuple, Frame]:
+    '''
+    Rotate, flip or transpose encoded [data] losslessly (see OPERATIONS).
+    The quantized coefficients are rearranged and entropy coded again: no IDCT/DCT and no further quantization loss.
+    The blocks are mirrored in place, so the partial blocks (MCUs) at the right/bottom edge that would move to the
+    left/top are trimmed (like jpegtran -trim). The result may be slightly smaller than the rotated image.
+    :return: Encoded data, its image shape and the Frame to decode it (with transposed quantization tables and
+    sampling factors if the operation transposes).
+    '''
+    if operation not in OPERATIONS:
+        raise ValueError(f'Unknown operation {operation}. Support: {list(OPERATIONS)}')
+    transpose, hflip, vflip = OPERATIONS[operation]
+    if not (transpose or hflip or vflip):
+        return data, tuple(image_shape), frame
+
+    coefs, mode     = frame.decode_coefficients(data, image_shape, mode=mode)
+    components      = frame.components[:len(coefs)]
+    max_sfactor     = [max(comp.sampling_factor[i] for comp in components) for i in range(2)]
+
+    ### Trim the edges that will be mirrored to whole MCUs ###
+    # axes of the source image that are mirrored: (height, width)
+    mirror          = (hflip, vflip) if transpose else (vflip, hflip)
+    shape           = list(image_shape[:2])
+    for axis in range(2):
+        # sampling factor is (horizontal, vertical)
+        factor      = 1 - axis
+        unit        = 8 * max_sfactor[factor] // min(comp.sampling_factor[factor] for comp in components)
+        if mirror[axis]:
+            shape[axis] -= shape[axis] % unit
+            if shape[axis] == 0:
+                raise ValueError(f'Image {tuple(image_shape[:2])} is too small to be trimmed to whole MCUs ({unit} pixels)')
+
+    ### Frame of the result ###
+    result_frame    = copy.deepcopy(frame)
+    result_shape    = (shape[1], shape[0]) if transpose else tuple(shape)
+    if transpose:
+        for comp in result_frame.components:
+            comp.sampling_factor    = tuple(reversed(comp.sampling_factor))
+            comp.quantization_table = QuantizationTable(comp.quantization_table.table.T)
+    result_components   = result_frame.components[:len(coefs)]
+    result_max_sfactor  = max_sfactor[::-1] if transpose else max_sfactor
+
+    ### Rearrange blocks and coefficients ###
+    frequencies     = np.arange(8)
+    horizontal_sign = np.where(frequencies % 2, -1, 1)[None, :] # negate odd horizontal frequencies
+    vertical_sign   = horizontal_sign.T
+    result_coefs    = []
+    for comp, result_comp, c in zip(components, result_components, coefs):
+        rows, cols  = comp.create_block_container(image_shape[:2], max_sfactor, mode).positions()
+        grid        = np.zeros((rows.max() + 1, cols.max() + 1, 8, 8), dtype=c.dtype)
+        grid[rows, cols] = c[:, ZigZagIndex].reshape(-1, 8, 8)
+
+        sh, sw      = utils.calculate_sampling_size(shape, comp.sampling_factor, max_sfactor)
+        grid        = grid[:sh >> 3 if mirror[0] else None, :sw >> 3 if mirror[1] else None]
+        if transpose:
+            grid    = grid.transpose(1, 0, 3, 2)
+        if hflip:
+            grid    = grid[:, ::-1] * horizontal_sign
+        if vflip:
+            grid    = grid[::-1] * vertical_sign
+
+        rows, cols  = result_comp.create_block_container(result_shape, result_max_sfactor, mode).positions()
+        result_coefs.append(np.ascontiguousarray(grid[rows, cols].reshape(-1, 64)[:, NaturalIndex], dtype=c.dtype))
+
+    encoded = result_frame.encode_coefficients(result_coefs, mode=mode)
+    return encoded, result_shape + tuple(image_shape[2:]), result_frame
+
+def normalize_orientation(frame: Frame, data: bytes, image_shape: tuple, orientation: int, *,
+                          mode: str = 'non-interleave') -> tuple[bytes, tuple, Frame]:
+    '''
+    Losslessly bring encoded [data] with EXIF [orientation] tag (1..8) to the normal orientation. See transform().
+    '''
+    if orientation not in EXIF_ORIENTATIONS:
+        raise ValueError(f'Invalid EXIF orientation {orientation}')
+    return transform(frame, data, image_shape, EXIF_ORIENTATIONS[orientation], mode=mode)
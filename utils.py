@@ -1,7 +1,8 @@
-import cv2
 import numpy as np
 import bitarray
 
+import backend
+
 ZigZagOrder = [
             [0, 1, 5, 6, 14, 15, 27, 28],
             [2, 4, 7, 13, 16, 26, 29, 42],
@@ -12,6 +13,11 @@ ZigZagOrder = [
             [21, 34, 37, 47, 50, 56, 59, 61],
             [35, 36, 48, 49, 57, 58, 62, 63],
         ]
+# ZigZagIndex[r * 8 + c] = ZigZagOrder[r][c]: zigzag rows (N x 64) -> natural rows by zigzag[:, ZigZagIndex]
+ZigZagIndex = np.array(ZigZagOrder).flatten()
+# NaturalIndex: natural rows (N x 64) -> zigzag rows by natural[:, NaturalIndex]
+NaturalIndex = np.argsort(ZigZagIndex)
+
 def tolist_zigzag(data: np.ndarray, item_type_converter = int) -> list:
     '''
     Convert 2D data (8 x 8) to 1D data (64) using zigzag order.
@@ -36,6 +42,34 @@ def fromlist_zigzag(data: list, item_type = np.int32) -> np.ndarray:
             result[r][c] = data[ZigZagOrder[r][c]]
     return np.array(result, dtype=item_type)
     
+def last_nonzero_index(coefs: np.ndarray) -> np.ndarray:
+    '''
+    Index of the last nonzero element in each row of [coefs] (0 for all-zero rows).
+    '''
+    nonzero = coefs != 0
+    return np.where(nonzero.any(axis=1), coefs.shape[1] - 1 - np.argmax(nonzero[:, ::-1], axis=1), 0)
+
+def blockwise_dct(data: np.ndarray) -> np.ndarray:
+    '''
+    DCT of each 8 x 8 block of 2D [data] (padded and level shifted, see Frame.preencode_components()).
+    :return: rows x columns x 8 x 8
+    '''
+    blocks = np.float32(data).reshape(data.shape[0] >> 3, 8, data.shape[1] >> 3, 8).transpose(0, 2, 1, 3)
+    return backend.dct(blocks)
+
+def downscale_dct(coefs: np.ndarray, scale: int, size: tuple, precision: int = 8) -> np.ndarray:
+    '''
+    Downscale by [scale] (1, 2, 4 or 8) from blockwise DCT [coefs] (see blockwise_dct()), crop to [size].
+    Each block is restored from its low frequency (8 / scale) x (8 / scale) coefs by a smaller IDCT.
+    :return: Samples of [precision] bits (level shift removed).
+    '''
+    n       = 8 // scale
+    basis   = backend.dct_matrix(n)
+    pixels  = basis.T @ (np.float64(coefs[..., :n, :n]) * (n / 8)) @ basis
+    plane   = pixels.transpose(0, 2, 1, 3).reshape(coefs.shape[0] * n, coefs.shape[1] * n)
+    plane   = np.clip(np.rint(plane[:size[0], :size[1]] + (1 << (precision - 1))), 0, (1 << precision) - 1)
+    return plane.astype(np.uint8 if precision <= 8 else np.uint16)
+
 def round_up(value: int, divisor: int) -> int:
     '''
     Round [value] to nearest larger number that divisible by [divisor]
@@ -43,6 +77,7 @@ def round_up(value: int, divisor: int) -> int:
     return value if value % divisor == 0 else (value // divisor + 1) * divisor
 
 def load_image(path: str):
+    import cv2 # image file I/O only
     return cv2.imread(path)
 
 def save_encoded_image(path: str, data: bitarray):
@@ -59,6 +94,12 @@ def calculate_padding_size(sampling_size, sfactor, mode = 'non-interleave'):
     else:
         return round_up(sampling_size[0], 8 * sfactor[0]), round_up(sampling_size[1], 8 * sfactor[1])
 
+def parse_sampling_format(text: str) -> int:
+    '''
+    Sampling format from text: '420' or '4:2:0' -> 420. See get_sampling_factor().
+    '''
+    return int(text.replace(':', ''))
+
 def get_sampling_factor(factor: int) -> tuple:
     if   factor == 444:     lf = (1, 1)
     elif factor == 440:     lf = (1, 2)
@@ -68,6 +109,21 @@ def get_sampling_factor(factor: int) -> tuple:
     elif factor == 411:     lf = (4, 1)
     else:                   lf = (2, 2)
     return [lf, (1, 1)]
+
+def get_progressive_scans(number_of_components: int) -> list[tuple]:
+    '''
+    Suggested scan script for progressive mode. Each scan is (component index, Ss, Se, Ah, Al):
+    spectral selection [Ss, Se] in zigzag order, successive approximation from bit Ah to bit Al.
+    '''
+    scans = [(0, 0, 0, 0, 1), (1, 0, 0, 0, 1), (2, 0, 0, 0, 1),     # DC first
+             (0, 1, 5, 0, 2),                                       # low frequency luma
+             (2, 1, 63, 0, 1), (1, 1, 63, 0, 1),                    # chroma AC
+             (0, 6, 63, 0, 2),                                      # high frequency luma
+             (0, 1, 63, 2, 1),                                      # luma AC refinement
+             (0, 0, 0, 1, 0), (1, 0, 0, 1, 0), (2, 0, 0, 1, 0),     # DC refinement
+             (2, 1, 63, 1, 0), (1, 1, 63, 1, 0),                    # chroma AC refinement
+             (0, 1, 63, 1, 0)]                                      # last luma AC refinement
+    return [scan for scan in scans if scan[0] < number_of_components]
     
 def broadcast(array: list, length: int) -> list:
     '''